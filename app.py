@@ -1,39 +1,252 @@
-from flask import Flask, render_template, request, redirect, flash, session
+from flask import Flask, render_template, request, redirect, flash, session, jsonify
 import os
 import requests
 import random
+import sqlite3
 import string
+import tempfile
+import threading
+import time
+import atexit
+import click
+import io
+import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from flask_sqlalchemy import SQLAlchemy
-from pushbullet import Pushbullet
-from bs4 import BeautifulSoup
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from pushbullet import InvalidKeyError
 from apscheduler.schedulers.background import BackgroundScheduler
 from datetime import datetime, timedelta
 
-import time
+import dmm_client
+import history
+import leader
+import notifier
+import page_cache
+import poll_policy
+import publish_predictor
+import slots
+import teacher_page
+from fetcher import fetch_engine
 
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get("DATABASE_URL", 'sqlite:///database.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = 'your_secret_key'
 
+# 🌟 SQLite の設定（Webとポーラーが同時に書き込んでも待たされにくくする）
+SQLITE_JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000))
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+SQLITE_CACHE_SIZE_KB = int(os.environ.get("SQLITE_CACHE_SIZE_KB", 20000))
+# gunicorn のスレッド数 + ポーラーのジョブ分
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith("sqlite"):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_POOL_SIZE,
+        "connect_args": {"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+    }
+
 db = SQLAlchemy(app)
 
-class UserData(db.Model):
+@db.event.listens_for(db.Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size={-SQLITE_CACHE_SIZE_KB}")
+    cursor.close()
+
+# ✅ 講師ごとの情報と空き枠の状態（登録ユーザーが何人いても1行）
+class Teacher(db.Model):
+    id = db.Column(db.String(100), primary_key=True)  # 講師番号
+    name = db.Column(db.String(255), nullable=True)
+    last_available_count = db.Column(db.Integer, nullable=False, default=0)
+    last_checked_at = db.Column(db.DateTime, nullable=True)
+    # 空き枠のビットマスク（slot_base からの30分枠ごとに1ビット）
+    slot_base = db.Column(db.DateTime, nullable=True)
+    slot_mask = db.Column(db.LargeBinary, nullable=True)
+    # 次にページを取得する時刻と、そのときの間隔（変化がないほど長くなる）
+    next_poll_at = db.Column(db.DateTime, nullable=True, index=True)
+    poll_interval_seconds = db.Column(db.Integer, nullable=True)
+    # 講師ページが続けて見つからなかった回数（多いほど次のチェックを先に延ばす）
+    fail_count = db.Column(db.Integer, nullable=False, default=0)
+    # 枠の公開が予測される時刻（日本時間の0:00からの分）と、その前後の幅（分）。予測できなければ NULL
+    publish_minute = db.Column(db.Integer, nullable=True)
+    publish_half_width = db.Column(db.Integer, nullable=True)
+
+# ✅ ユーザーごとの情報（通知先トークンと最終アクセス）
+class Subscriber(db.Model):
+    user_id = db.Column(db.String(255), primary_key=True)
+    pushbullet_token = db.Column(db.String(255), nullable=False)
+    last_accessed = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+# ✅ どのユーザーがどの講師を登録しているか
+class Subscription(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    teacher_id = db.Column(db.String(100), nullable=False)
-    teacher_name = db.Column(db.String(255), nullable=True)
+    user_id = db.Column(db.String(255), db.ForeignKey("subscriber.user_id"), nullable=False)
+    teacher_id = db.Column(db.String(100), db.ForeignKey("teacher.id"), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # 通知してほしい時間帯（1週間分の30分枠のビットマスク。NULL ならいつでも）
+    window_mask = db.Column(db.LargeBinary, nullable=True)
+
+    # (user_id, teacher_id) のユニークインデックスは user_id での検索にも使われる
+    __table_args__ = (db.UniqueConstraint("user_id", "teacher_id", name="uq_subscription_user_teacher"),)
+
+# ✅ 通知の送信待ちキュー（再起動しても消えないようにDBに保存）
+class NotificationJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    idempotency_key = db.Column(db.String(255), unique=True, nullable=False)
     pushbullet_token = db.Column(db.String(255), nullable=False)
-    last_available_count = db.Column(db.Integer, default=0)
-    user_id = db.Column(db.String(255), nullable=False)
-    last_accessed = db.Column(db.DateTime, default=datetime.utcnow)
+    teacher_id = db.Column(db.String(100), nullable=False)
+    title = db.Column(db.String(255), nullable=False)
+    url = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default="pending", index=True)  # pending / sending / sent / failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claimed_by = db.Column(db.String(32), nullable=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.String(255), nullable=True)
+
+# ✅ 存在しない（退会した）講師番号の記録。期限までは登録もDMMへの確認もしない
+class InvalidTeacher(db.Model):
+    teacher_id = db.Column(db.String(100), primary_key=True)
+    checked_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+def migrate_legacy_user_data(conn):
+    # 旧 user_data テーブル（ユーザー×講師で1行）が残っていれば新しいテーブルへ移す
+    if not db.inspect(conn).has_table("user_data"):
+        return
+
+    conn.execute(db.text("""
+        INSERT OR IGNORE INTO teacher (id, name, last_available_count)
+        SELECT teacher_id, MAX(teacher_name), COALESCE(MAX(last_available_count), 0)
+        FROM user_data GROUP BY teacher_id
+    """))
+    # トークンはユーザーが最後に登録したものを使う
+    conn.execute(db.text("""
+        INSERT OR IGNORE INTO subscriber (user_id, pushbullet_token, last_accessed)
+        SELECT u.user_id, u.pushbullet_token, latest.last_accessed
+        FROM user_data u
+        JOIN (SELECT user_id, MAX(id) AS id, MAX(last_accessed) AS last_accessed
+              FROM user_data GROUP BY user_id) latest ON u.id = latest.id
+    """))
+    moved = conn.execute(db.text("""
+        INSERT OR IGNORE INTO subscription (user_id, teacher_id, created_at)
+        SELECT user_id, teacher_id, MIN(last_accessed)
+        FROM user_data GROUP BY user_id, teacher_id
+    """)).rowcount
+    # 2回目以降は移行しないように旧テーブルは名前を変えて残しておく
+    conn.execute(db.text("ALTER TABLE user_data RENAME TO user_data_legacy"))
+    print(f"🚚 旧 user_data から {moved} 件の登録を移行しました")
+
+def add_missing_columns(conn):
+    # 既存のテーブルに後から追加したカラムを ALTER TABLE で足す（create_all は既存テーブルを変更しないため）
+    inspector = db.inspect(conn)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=conn.dialect)
+                # 既存の行にも初期値を入れる（default=0 のカラムが NULL のままにならないように）
+                if column.default is not None and column.default.is_scalar:
+                    column_type += f" DEFAULT {column.default.arg!r}"
+                conn.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+                print(f"🔧 {table.name}.{column.name} を追加しました")
+        # 追加したカラムのインデックスも足す
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+def prepare_database():
+    # ✅ テーブル作成・カラム追加・旧データの移行を BEGIN IMMEDIATE の1トランザクションで行う。
+    #    gunicorn の複数ワーカーが同時に起動しても、後から来たワーカーは書き込みロックを待ってから
+    #    作成・移行済みの状態を見るので、二重にコピーしたり途中で失敗したりしない（SQLite の DDL もロールバックできる）
+    with db.engine.connect() as conn:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        db.metadata.create_all(conn)
+        add_missing_columns(conn)
+        migrate_legacy_user_data(conn)
+        conn.commit()
 
 with app.app_context():
-    db.create_all()
+    prepare_database()
+
+# 🌟 最終アクセス時間をまとめてDBに書き込む間隔（秒）
+ACCESS_FLUSH_SECONDS = int(os.environ.get("ACCESS_FLUSH_SECONDS", 60))
+
+class AccessBuffer:
+    # 最終アクセス時間はメモリに貯めておき、一定間隔でまとめて UPDATE する
+    # （使うのは30日の保持期間の判定だけなので、1日1回書ければ十分）
+    def __init__(self, flush_seconds):
+        self.flush_seconds = flush_seconds
+        self._pending = {}
+        self._flushed_today = set()
+        self._today = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def touch(self, user_id):
+        now = datetime.utcnow()
+        with self._lock:
+            if self._today != now.date():
+                self._today = now.date()
+                self._flushed_today.clear()
+            if user_id in self._flushed_today:
+                return
+            self._pending[user_id] = now
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="access-buffer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠ 最終アクセス時間の保存に失敗しました: {e}")
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        table = Subscriber.__table__
+        today_start = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+        # 今日すでに書き込まれているユーザー（別プロセス分も含む）は更新しない
+        stmt = (
+            db.update(table)
+            .where(table.c.user_id == db.bindparam("b_user_id"), table.c.last_accessed < today_start)
+            .values(last_accessed=db.bindparam("b_accessed"))
+        )
+        with app.app_context():
+            db.session.execute(stmt, [{"b_user_id": user_id, "b_accessed": accessed} for user_id, accessed in pending.items()])
+            db.session.commit()
 
-HEADERS = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-}
+        with self._lock:
+            for user_id, accessed in pending.items():
+                if accessed.date() == self._today:
+                    self._flushed_today.add(user_id)
+        return len(pending)
+
+access_buffer = AccessBuffer(ACCESS_FLUSH_SECONDS)
+atexit.register(access_buffer.flush)
 
 def generate_user_id(length=10):
     return 'user_' + ''.join(random.choices(string.ascii_lowercase + string.digits, k=length))
@@ -59,7 +272,7 @@ def set_user():
 
         if action == "login":
             # ログイン処理（既存IDのみ許可）
-            existing = UserData.query.filter_by(user_id=user_id).first()
+            existing = db.session.get(Subscriber, user_id)
             if existing:
                 session["user_id"] = user_id
                 flash(f"ユーザーIDでログインしました: {user_id}", "success")
@@ -86,62 +299,116 @@ def set_user():
 
 
 
+# 1ユーザーが登録できる講師数の上限
+MAX_TEACHERS_PER_USER = 10
+
 @app.route("/", methods=["GET", "POST"])
 def index():
     user_id = session.get("user_id")
     if not user_id:
         return redirect("/set_user")
 
-    # 最終アクセス時間の更新
-    UserData.query.filter_by(user_id=user_id).update({"last_accessed": datetime.utcnow()})
-    db.session.commit()
+    # 最終アクセス時間の更新（メモリに記録して後でまとめて書き込む）
+    access_buffer.touch(user_id)
 
-    total_teachers = UserData.query.filter_by(user_id=user_id).count()
+    # ✅ 登録済みの講師は1回のクエリで取得し、件数や重複チェックもここから判定する
+    all_data = (
+        db.session.query(Subscription.teacher_id, Teacher.name.label("teacher_name"), Subscription.window_mask)
+        .join(Teacher, Teacher.id == Subscription.teacher_id)
+        .filter(Subscription.user_id == user_id)
+        .order_by(Subscription.id)
+        .all()
+    )
+    total_teachers = len(all_data)
 
     if request.method == "POST":
-        if total_teachers >= 10:
-            flash("このアカウントでは最大10件までしか登録できません！", "danger")
+        if total_teachers >= MAX_TEACHERS_PER_USER:
+            flash(f"このアカウントでは最大{MAX_TEACHERS_PER_USER}件までしか登録できません！", "danger")
             return redirect("/")
 
         teacher_id = request.form.get("teacher_id")
         pushbullet_token = request.form.get("pushbullet_token")
 
+        if not teacher_id or not pushbullet_token:
+            flash("すべての項目を入力してください！", "danger")
+            return redirect("/")
+
         # ✅ 入力された講師番号が数字だけかどうかチェック
         if not teacher_id.isdigit():
             flash("講師番号は数字のみで入力してください。", "danger")
             return redirect("/")
 
-        if not teacher_id or not pushbullet_token:
-            flash("すべての項目を入力してください！", "danger")
-            return redirect("/")
-
-        existing_teacher = UserData.query.filter_by(teacher_id=teacher_id, user_id=user_id).first()
-        if existing_teacher:
+        if any(row.teacher_id == teacher_id for row in all_data):
             flash("この講師はすでに登録されています！", "warning")
             return redirect("/")
 
-        teacher_name = get_teacher_name(teacher_id)
+        # 通知する時間帯（曜日を1つも選ばなければ、いつでも通知）
+        window_days = [int(day) for day in request.form.getlist("window_days") if day.isdigit() and int(day) < 7]
+        window_mask = None
+        if window_days:
+            start_hour = request.form.get("window_start", "0")
+            end_hour = request.form.get("window_end", "24")
+            if not (start_hour.isdigit() and end_hour.isdigit() and int(start_hour) < int(end_hour) <= 24):
+                flash("通知する時間帯の開始と終了を確認してください。", "danger")
+                return redirect("/")
+            window_mask = slots.to_bytes(slots.window_mask(window_days, int(start_hour), int(end_hour)))
 
-        # ✅ 講師名が取得できなければエラーで終了
-        if not teacher_name:
-            flash("講師情報が取得できませんでした。番号を確認してください。", "danger")
+        # ✅ 存在しないと分かっている講師番号は、DMMに問い合わせずに断る
+        if is_known_invalid(teacher_id):
+            flash("この講師番号の講師は見つかりませんでした。番号を確認してください。", "danger")
             return redirect("/")
 
-        # 登録処理
-        new_data = UserData(
-            teacher_id=teacher_id,
-            teacher_name=teacher_name,
-            pushbullet_token=pushbullet_token,
-            user_id=user_id
+        # ✅ 講師名が分かっている講師はDBだけで登録する。初めての講師は「確認中」で登録し、
+        #    講師ページの確認はバックグラウンドで行う（リクエスト中にDMMへアクセスしない）
+        teacher_name = db.session.query(Teacher.name).filter(Teacher.id == teacher_id).scalar()
+
+        # 登録処理（講師・ユーザーは無ければ作り、ユーザーはトークンを最新にする）
+        db.session.execute(
+            sqlite_insert(Teacher)
+            .values(id=teacher_id, name=None, last_available_count=0)
+            .on_conflict_do_nothing()
+        )
+        db.session.execute(
+            sqlite_insert(Subscriber)
+            .values(user_id=user_id, pushbullet_token=pushbullet_token, last_accessed=datetime.utcnow())
+            .on_conflict_do_update(index_elements=[Subscriber.user_id], set_={"pushbullet_token": pushbullet_token})
         )
-        db.session.add(new_data)
+        # 上限チェックと追加を1つの INSERT で行う（同時に POST されても上限を超えない）
+        registered = db.session.query(db.func.count(Subscription.id)).filter(Subscription.user_id == user_id).scalar_subquery()
+        inserted = db.session.execute(
+            sqlite_insert(Subscription)
+            .from_select(
+                ["user_id", "teacher_id", "created_at", "window_mask"],
+                db.select(
+                    db.literal(user_id),
+                    db.literal(teacher_id),
+                    db.literal(datetime.utcnow()),
+                    db.literal(window_mask, db.LargeBinary),
+                )
+                .where(registered < MAX_TEACHERS_PER_USER),
+            )
+            .on_conflict_do_nothing()
+        ).rowcount
+        if not inserted:
+            db.session.rollback()
+            # 同時に送られた同じ講師の登録と重なったときは ON CONFLICT で何もしていない
+            duplicated = db.session.query(Subscription.id).filter_by(user_id=user_id, teacher_id=teacher_id).first()
+            if duplicated:
+                flash("この講師はすでに登録されています！", "warning")
+            else:
+                flash(f"このアカウントでは最大{MAX_TEACHERS_PER_USER}件までしか登録できません！", "danger")
+            return redirect("/")
+
         db.session.commit()
-        flash(f"{teacher_name} (講師番号: {teacher_id}) を登録しました！", "success")
+        if teacher_name:
+            flash(f"{teacher_name} (講師番号: {teacher_id}) を登録しました！", "success")
+        else:
+            fetch_engine.submit(resolve_teacher, teacher_id)
+            flash(f"講師番号 {teacher_id} を登録しました！講師情報を確認しています。", "success")
 
         return redirect("/")
 
     # GETメソッド時：登録済みデータを表示
-    all_data = UserData.query.filter_by(user_id=user_id).all()
     return render_template("index.html", all_data=all_data, total_teachers=total_teachers, user_id=user_id)
 
 
@@ -153,6 +420,10 @@ def index():
 
 
 
+@app.template_filter("window")
+def describe_window(window_mask):
+    return slots.describe_window(slots.from_bytes(window_mask) if window_mask is not None else None)
+
 @app.route("/delete_teacher", methods=["POST", "GET"])
 def delete_teacher():
     if request.method == "GET":
@@ -160,7 +431,7 @@ def delete_teacher():
 
     teacher_id = request.form.get("teacher_id")
     user_id = session.get("user_id")
-    teacher_data = UserData.query.filter_by(teacher_id=teacher_id, user_id=user_id).first()
+    teacher_data = Subscription.query.filter_by(teacher_id=teacher_id, user_id=user_id).first()
     if teacher_data:
         db.session.delete(teacher_data)
         db.session.commit()
@@ -182,7 +453,8 @@ def reset_user():
 
     # ユーザーに紐づく講師データを全削除
     if user_id:
-        UserData.query.filter_by(user_id=user_id).delete()
+        Subscription.query.filter_by(user_id=user_id).delete()
+        Subscriber.query.filter_by(user_id=user_id).delete()
         db.session.commit()
 
     # セッションからユーザーIDを削除
@@ -204,92 +476,600 @@ def reset_user():
 def tutorial():
     return render_template("tutorial.html")
 
-def get_teacher_name(teacher_id):
-    load_url = f"https://eikaiwa.dmm.com/teacher/index/{teacher_id}/"
-    try:
-        response = requests.get(load_url, headers=HEADERS, timeout=5, allow_redirects=True)
-        if response.url == "https://eikaiwa.dmm.com/":
-            return None
-        soup = BeautifulSoup(response.content, "html.parser")
-        teacher_name_tag = soup.find("h1")
-        return teacher_name_tag.text.strip() if teacher_name_tag else None
-    except requests.exceptions.RequestException:
+# 🌟 取得した講師ページの解析結果を使い回す秒数（登録とポーリングが重なっても取得は1回）
+TEACHER_PAGE_CACHE_SECONDS = int(os.environ.get("TEACHER_PAGE_CACHE_SECONDS", 20))
+teacher_pages = page_cache.PageCache(TEACHER_PAGE_CACHE_SECONDS)
+
+def fetch_teacher_page(teacher_id):
+    # 講師ページを1回取得して、講師名と空き枠をまとめて読み取る
+    # 講師ページが無ければ NOT_FOUND、DMM側の障害などで取れなければ None
+    response = dmm_client.get(dmm_client.teacher_url(teacher_id))
+    if response.status_code in (404, 410) or response.url == dmm_client.DMM_TOP_URL:
+        return dmm_client.NOT_FOUND
+    if response.status_code != 200:
         return None
+    return teacher_page.FetchedPage(
+        name=teacher_page.teacher_name(response.content),
+        slots=teacher_page.extract_slots(response.content, teacher_id),
+        fetched_at=datetime.utcnow(),
+    )
 
-def get_available_slots(teacher_id):
-    load_url = f"https://eikaiwa.dmm.com/teacher/index/{teacher_id}/"
+def get_teacher_page(teacher_id):
     try:
-        response = requests.get(load_url, headers=HEADERS, timeout=5)
-        if response.status_code != 200 or response.url == "https://eikaiwa.dmm.com/":
-            return None
-        soup = BeautifulSoup(response.content, "html.parser")
-        return len(soup.find_all(string="予約可"))
+        return teacher_pages.get(teacher_id, fetch_teacher_page)
     except requests.exceptions.RequestException:
         return None
 
-def send_push_notification(user_token, teacher_id, name):
+def get_teacher_name(teacher_id):
+    page = get_teacher_page(teacher_id)
+    if page is None or page == dmm_client.NOT_FOUND:
+        return page
+    return page.name
+
+# 🌟 存在しない講師番号を覚えておく時間（新しい講師に番号が割り当てられることもあるので永久にはしない）
+INVALID_TEACHER_TTL_HOURS = int(os.environ.get("INVALID_TEACHER_TTL_HOURS", 24))
+
+def is_known_invalid(teacher_id):
+    return db.session.query(InvalidTeacher.teacher_id).filter(
+        InvalidTeacher.teacher_id == teacher_id,
+        InvalidTeacher.expires_at > datetime.utcnow(),
+    ).first() is not None
+
+def remember_invalid_teachers(teacher_ids, now):
+    # 見つからなかった講師番号を期限付きで記録する（コミットは呼び出し側）
+    if not teacher_ids:
+        return
+    expires_at = now + timedelta(hours=INVALID_TEACHER_TTL_HOURS)
+    insert = sqlite_insert(InvalidTeacher)
+    db.session.execute(
+        insert.on_conflict_do_update(
+            index_elements=[InvalidTeacher.teacher_id],
+            set_={"checked_at": insert.excluded.checked_at, "expires_at": insert.excluded.expires_at},
+        ),
+        [{"teacher_id": teacher_id, "checked_at": now, "expires_at": expires_at} for teacher_id in teacher_ids],
+    )
+
+def drop_pending_teachers(teacher_ids):
+    # 講師名が一度も取れないまま「見つからない」と分かった講師は、登録ごと消す（コミットは呼び出し側）
+    pending = db.select(Teacher.id).where(Teacher.id.in_(teacher_ids), Teacher.name.is_(None))
+    db.session.execute(db.delete(Subscription).where(Subscription.teacher_id.in_(pending)))
+    db.session.execute(db.delete(Teacher).where(Teacher.id.in_(pending)))
+
+def resolve_teacher(teacher_id):
+    # 「確認中」の講師の講師名を取得する。講師がいなければ登録ごと取り消す
+    with app.app_context():
+        teacher_name = get_teacher_name(teacher_id)
+        if teacher_name is None:
+            # DMM側の障害などで取れなかったときは、ポーリングで取得できたときに埋める
+            print(f"⚠ 講師情報を取得できませんでした（講師番号: {teacher_id}）")
+            return
+        if teacher_name == dmm_client.NOT_FOUND:
+            remember_invalid_teachers([teacher_id], datetime.utcnow())
+            drop_pending_teachers([teacher_id])
+            db.session.commit()
+            print(f"👻 講師番号 {teacher_id} の講師は見つかりませんでした。登録を取り消しました")
+            return
+        db.session.execute(
+            db.update(Teacher).where(Teacher.id == teacher_id, Teacher.name.is_(None)).values(name=teacher_name)
+        )
+        db.session.commit()
+
+# 🌟 通知送信の設定（環境変数 or デフォルト）
+OUTBOX_WORKERS = int(os.environ.get("OUTBOX_WORKERS", 4))
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 50))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 5))
+OUTBOX_RETRY_SECONDS = int(os.environ.get("OUTBOX_RETRY_SECONDS", 30))
+OUTBOX_INTERVAL_SECONDS = int(os.environ.get("OUTBOX_INTERVAL_SECONDS", 10))
+
+outbox_executor = ThreadPoolExecutor(max_workers=OUTBOX_WORKERS, thread_name_prefix="outbox")
+
+def notification_job(subscription, teacher, event_key, opened_times=None):
+    # 同じイベントで同じユーザーに2回積まないよう idempotency_key を一意にする
+    return {
+        "idempotency_key": f"{subscription.id}:{teacher.id}:{event_key}",
+        "pushbullet_token": subscription.pushbullet_token,
+        "teacher_id": teacher.id,
+        "title": f"{teacher.name} レッスン開講通知",
+        "url": dmm_client.teacher_url(teacher.id),
+        "body": f"新しい空き枠: {slots.format_times(opened_times)}" if opened_times else None,
+    }
+
+def deliver_notifications():
+    with app.app_context():
+        now = datetime.utcnow()
+
+        # 送信中のまま止まったジョブ（プロセス停止など）は、二重送信を避けるため再送せず失敗扱い
+        NotificationJob.query.filter(
+            NotificationJob.status == "sending",
+            NotificationJob.claimed_at < now - timedelta(minutes=5),
+        ).update({"status": "failed", "last_error": "送信中に中断されました"}, synchronize_session=False)
+
+        # 送信対象を「送信中」にして確保（確保できたものだけ送る）
+        due_ids = [job_id for (job_id,) in db.session.query(NotificationJob.id).filter(
+            NotificationJob.status == "pending",
+            NotificationJob.next_attempt_at <= now,
+        ).order_by(NotificationJob.id).limit(OUTBOX_BATCH_SIZE)]
+        claim = uuid.uuid4().hex
+        if due_ids:
+            NotificationJob.query.filter(
+                NotificationJob.id.in_(due_ids),
+                NotificationJob.status == "pending",
+            ).update({"status": "sending", "claimed_by": claim, "claimed_at": now}, synchronize_session=False)
+        db.session.commit()
+
+        jobs = NotificationJob.query.filter_by(claimed_by=claim, status="sending").all()
+        if not jobs:
+            return
+
+        futures = {
+            outbox_executor.submit(notifier.push_link, job.pushbullet_token, job.title, job.url, job.body): job
+            for job in jobs
+        }
+        sent = 0
+        for future in as_completed(futures):
+            job = futures[future]
+            job.attempts += 1
+            try:
+                future.result()
+                job.status = "sent"
+                job.sent_at = datetime.utcnow()
+                sent += 1
+            except InvalidKeyError:
+                job.status = "failed"
+                job.last_error = "Pushbulletトークンが無効です"
+            except Exception as e:
+                job.last_error = str(e)[:255]
+                if job.attempts >= OUTBOX_MAX_ATTEMPTS:
+                    job.status = "failed"
+                else:
+                    # 失敗するたびに再送までの間隔を倍にする
+                    job.status = "pending"
+                    job.next_attempt_at = datetime.utcnow() + timedelta(seconds=OUTBOX_RETRY_SECONDS * 2 ** (job.attempts - 1))
+        db.session.commit()
+
+        stats = outbox_stats()
+        print(f"📨 通知を {sent}/{len(jobs)} 件送信しました（残り {stats['queue_depth']} 件 / 平均遅延 {stats['avg_latency_seconds']:.1f}秒）")
+
+def outbox_stats():
+    # 送信待ちの件数と、直近1時間に送った通知の検知〜送信までの遅延
+    since = datetime.utcnow() - timedelta(hours=1)
+    latency = (db.func.julianday(NotificationJob.sent_at) - db.func.julianday(NotificationJob.created_at)) * 86400
+    avg_latency, max_latency = db.session.query(db.func.avg(latency), db.func.max(latency)).filter(
+        NotificationJob.status == "sent",
+        NotificationJob.sent_at >= since,
+    ).one()
+    return {
+        "queue_depth": NotificationJob.query.filter(NotificationJob.status.in_(["pending", "sending"])).count(),
+        "failed": NotificationJob.query.filter_by(status="failed").count(),
+        "avg_latency_seconds": avg_latency or 0.0,
+        "max_latency_seconds": max_latency or 0.0,
+    }
+
+@app.route("/outbox_status")
+def outbox_status():
+    return jsonify(outbox_stats())
+
+# 🌟 ポーラーのキャッシュの状況の書き出し先（ポーラーは別スレッド・別プロセスなので、ファイル経由で見せる）
+POLLER_STATS_FILE = os.environ.get("POLLER_STATS_FILE", os.path.join(app.instance_path, "poller_stats.json"))
+
+def write_poller_stats():
+    stats = {
+        "teacher_pages": teacher_pages.stats(),
+        "fetch": fetch_engine.last_stats,
+        "updated_at": datetime.utcnow().isoformat(),
+    }
+    os.makedirs(os.path.dirname(POLLER_STATS_FILE), exist_ok=True)
+    tmp_path = f"{POLLER_STATS_FILE}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(stats, f)
+    os.replace(tmp_path, POLLER_STATS_FILE)
+
+@app.route("/cache_status")
+def cache_status():
+    # このプロセス（登録時の取得）と、ポーラーが最後に書き出したキャッシュの状況
     try:
-        pb_user = Pushbullet(user_token)
-        url = f"https://eikaiwa.dmm.com/teacher/index/{teacher_id}/"
-        pb_user.push_link(f"{name} レッスン開講通知", url)
-    except Exception as e:
-        print(f"⚠ Pushbullet通知の送信に失敗しました: {e}")
+        with open(POLLER_STATS_FILE) as f:
+            poller = json.load(f)
+    except (OSError, ValueError):
+        poller = None
+    return jsonify({"web": teacher_pages.stats(), "poller": poller})
+
+# 🌟 1トランザクションでまとめて更新する講師数（0なら1サイクル全体を1回でコミット）
+POLL_COMMIT_CHUNK_SIZE = int(os.environ.get("POLL_COMMIT_CHUNK_SIZE", 1000))
+
+def save_poll_results(count_updates, jobs, history_rows=(), schedule_updates=(), invalid_ids=(), recovered_ids=()):
+    # 空き枠数の更新と通知ジョブの追加を、まとめて executemany で書き込む
+    table = Teacher.__table__
+    update_schedule = (
+        db.update(table)
+        .where(table.c.id == db.bindparam("b_teacher_id"))
+        .values(
+            next_poll_at=db.bindparam("b_next_poll_at"),
+            poll_interval_seconds=db.bindparam("b_interval"),
+            fail_count=db.bindparam("b_fail_count"),
+        )
+    )
+    update_counts = (
+        db.update(table)
+        .where(table.c.id == db.bindparam("b_teacher_id"))
+        .values(
+            last_available_count=db.bindparam("b_count"),
+            last_checked_at=db.bindparam("b_checked_at"),
+            slot_base=db.bindparam("b_slot_base"),
+            slot_mask=db.bindparam("b_slot_mask"),
+        )
+    )
+    chunk_size = POLL_COMMIT_CHUNK_SIZE or len(count_updates) or 1
+
+    if jobs:
+        db.session.execute(db.insert(NotificationJob), jobs)
+    if history_rows:
+        history.record(db.session, history_rows)
+    if schedule_updates:
+        db.session.execute(update_schedule, schedule_updates)
+    # 見つからなかった講師は記録し、また見つかった講師は記録から外す
+    remember_invalid_teachers(invalid_ids, datetime.utcnow())
+    if recovered_ids:
+        db.session.execute(db.delete(InvalidTeacher).where(InvalidTeacher.teacher_id.in_(recovered_ids)))
+    for start in range(0, len(count_updates), chunk_size):
+        db.session.execute(update_counts, count_updates[start:start + chunk_size])
+        db.session.commit()
+    db.session.commit()
+
+def detect_opened_slots(teacher, result, base):
+    # 前回から新しく空いた枠を調べる。戻り値は (通知するか, 新しく空いた枠のマスク, 今回のマスク)
+    new_mask = slots.to_mask(result.times, base)
+    if len(result.times) < result.count:
+        # 日時が読み取れない枠があるときは、これまで通り枠数の増加で判定する（空いた枠は不明なので None）
+        return result.count > teacher.last_available_count, None, new_mask
 
-# ✅ DMMアクセス連続失敗カウント用
-consecutive_errors = 0
-MAX_ERRORS = 5
+    if teacher.slot_mask is None:
+        # 初回（または旧データからの移行直後）は枠数で判定
+        opened = new_mask if result.count > teacher.last_available_count else 0
+    else:
+        opened = slots.opened_slots(slots.from_bytes(teacher.slot_mask), teacher.slot_base, new_mask, base)
+    return opened != 0, opened, new_mask
+
+def slots_changed(teacher, result, base, new_mask, now=None):
+    # 前回の観測から、これから先の空き枠が変わったか。履歴には変わったときだけ残す
+    # （開始時刻が過ぎてページから消えただけの枠は変化に数えない）
+    if teacher.last_checked_at is None:
+        return True
+    if teacher.slot_mask is None or len(result.times) < result.count:
+        return result.count != teacher.last_available_count
+    future = ~((1 << (slots.slot_index(now or slots.jst_now(), base) + 1)) - 1)
+    old_mask = slots.align(slots.from_bytes(teacher.slot_mask), teacher.slot_base, base)
+    return (new_mask & future) != (old_mask & future)
+
+# 講師ごとの「時間帯 → 登録者」の逆引き（登録内容が変わったときだけ作り直す）
+# 最近使った講師から MATCH_INDEX_MAX_ENTRIES 件だけ残す（登録がなくなった講師の分もいずれ消える）
+MATCH_INDEX_MAX_ENTRIES = int(os.environ.get("MATCH_INDEX_MAX_ENTRIES", 1000))
+match_indexes = {}
+
+def match_subscriptions(teacher_id, teacher_subscriptions, opened, base):
+    # 新しく空いた枠を通知してほしい登録と、その人向けの枠の時刻を返す
+    signature = tuple((sub.id, sub.window_mask) for sub in teacher_subscriptions)
+    cached = match_indexes.pop(teacher_id, None)
+    if cached is None or cached[0] != signature:
+        # 行そのものではなく並び順を覚えておく（トークンなど、署名に含めない列は毎回の最新の行から読む）
+        entries = [(i, slots.from_bytes(sub.window_mask) if sub.window_mask is not None else None) for i, sub in enumerate(teacher_subscriptions)]
+        cached = (signature, slots.SlotMatchIndex(entries))
+    match_indexes[teacher_id] = cached
+    while len(match_indexes) > MATCH_INDEX_MAX_ENTRIES:
+        del match_indexes[next(iter(match_indexes))]
+
+    matched = []
+    for i in cached[1].match(opened, base):
+        sub = teacher_subscriptions[i]
+        sub_opened = opened
+        if sub.window_mask is not None:
+            sub_opened &= slots.window_in_grid(slots.from_bytes(sub.window_mask), base, opened.bit_length())
+        matched.append((sub, slots.to_times(sub_opened, base)))
+    return matched
+
+# 🌟 チェック処理を動かす間隔（秒）。各講師を取得するかどうかは Teacher.next_poll_at で決める
+POLL_TICK_SECONDS = int(os.environ.get("POLL_TICK_SECONDS", 15))
+
+def due_teacher_ids(now, limit):
+    # 登録されている講師のうち次回時刻を過ぎたものを、待たせている順に（未取得の講師は NULL なので先頭）
+    query = (
+        db.select(Teacher.id)
+        .where(
+            Teacher.id.in_(db.select(Subscription.teacher_id)),
+            db.or_(Teacher.next_poll_at.is_(None), Teacher.next_poll_at <= now),
+        )
+        .order_by(Teacher.next_poll_at)
+    )
+    if limit is not None:
+        query = query.limit(limit)
+    return db.session.scalars(query).all()
 
 def check_teacher_availability():
-    global consecutive_errors
     with app.app_context():
         try:
-            users = UserData.query.all()
-            error_count_this_run = 0
-
-            for user in users:
-                time.sleep(random.uniform(0.5, 2.0))  # ✅ ここが追加ポイント！
-
-                current_count = get_available_slots(user.teacher_id)
-                if current_count is None:
-                    error_count_this_run += 1
+            # ✅ DMMが落ちている間（ブレーカーが開いている間）は何も取得しない
+            retry_after = dmm_client.breaker_for(dmm_client.DMM_TOP_URL).retry_after()
+            if retry_after > 0:
+                print(f"🚧 DMMへのアクセスを停止中です（あと{retry_after:.0f}秒）")
+                return
+
+            checked_at = datetime.utcnow()
+            # ✅ 1分あたりの取得数の予算に収まる分だけ、期限が来た講師を取得する
+            budget = poll_policy.tick_budget(POLL_TICK_SECONDS)
+            due_ids = due_teacher_ids(checked_at, budget)
+            if not due_ids:
+                return
+            if budget is not None and len(due_ids) == budget:
+                print(f"⏳ 取得予算（{poll_policy.POLL_BUDGET_PER_MINUTE}件/分）の上限まで取得します。残りは次回に回します")
+
+            rows = (
+                db.session.query(Subscription.id, Subscription.teacher_id, Subscription.window_mask, Subscriber.pushbullet_token)
+                .join(Subscriber, Subscriber.user_id == Subscription.user_id)
+                .filter(Subscription.teacher_id.in_(due_ids))
+                .all()
+            )
+
+            # ✅ 講師番号ごとに登録ユーザーをまとめる（同じ講師ページは1回だけ取得）
+            subscribers = {}
+            for row in rows:
+                subscribers.setdefault(row.teacher_id, []).append(row)
+            teachers = {teacher.id: teacher for teacher in Teacher.query.filter(Teacher.id.in_(list(subscribers)))}
+
+            # 同じ秒に2回サイクルが走っても冪等性キーが衝突しないようマイクロ秒まで含める
+            cycle_key = checked_at.strftime("%Y%m%d%H%M%S%f")
+            base = slots.slot_base()
+
+            # ✅ 講師ページは並列で取得（リクエスト間隔は fetch_engine が全体で制御）
+            results = fetch_engine.map(get_teacher_page, subscribers)
+            host_errors = 0
+            invalid_ids = []
+            pending_invalid_ids = []
+            recovered_ids = []
+            count_updates = []
+            jobs = []
+            history_rows = []
+            schedule_updates = []
+
+            for teacher_id, teacher_subscriptions in subscribers.items():
+                result = results[teacher_id]
+                teacher = teachers[teacher_id]
+                if result is None:
+                    # DMM側の失敗は講師のせいではないので、間隔は変えずに少し後でやり直す（止めるのはブレーカーの役目）
+                    host_errors += 1
+                    schedule_updates.append({
+                        "b_teacher_id": teacher_id,
+                        "b_next_poll_at": poll_policy.next_poll_at(checked_at, poll_policy.POLL_MIN_SECONDS),
+                        "b_interval": teacher.poll_interval_seconds,
+                        "b_fail_count": teacher.fail_count or 0,
+                    })
+                    continue
+                if result == dmm_client.NOT_FOUND:
+                    # 講師ページが無い講師だけ、失敗が続くほど長く休ませる
+                    invalid_ids.append(teacher_id)
+                    if teacher.name is None:
+                        pending_invalid_ids.append(teacher_id)
+                    fail_count = (teacher.fail_count or 0) + 1
+                    schedule_updates.append({
+                        "b_teacher_id": teacher_id,
+                        "b_next_poll_at": checked_at + timedelta(seconds=poll_policy.park_seconds(fail_count)),
+                        "b_interval": teacher.poll_interval_seconds,
+                        "b_fail_count": fail_count,
+                    })
                     continue
 
-                if current_count > user.last_available_count:
-                    send_push_notification(user.pushbullet_token, user.teacher_id, user.teacher_name)
-
-                user.last_available_count = current_count
+                if teacher.fail_count:
+                    recovered_ids.append(teacher_id)
+
+                if result.name and teacher.name is None:
+                    # 「確認中」の講師は、取得したページから講師名も埋める
+                    teacher.name = result.name
+                result = result.slots
+
+                # 講師の状態は1か所だけなので、比較も1回で済む（枠ごとのビット差分）
+                notify, opened, new_mask = detect_opened_slots(teacher, result, base)
+                if notify:
+                    # 枠が分かるときは、その枠を通知してほしい登録だけに絞る
+                    if opened is None:
+                        targets = [(subscription, None) for subscription in teacher_subscriptions]
+                    else:
+                        targets = match_subscriptions(teacher_id, teacher_subscriptions, opened, base)
+                    # 通知はキューに積むだけ（送信は deliver_notifications が別スレッドで行う）
+                    for subscription, opened_times in targets:
+                        jobs.append(notification_job(subscription, teacher, cycle_key, opened_times))
+                changed = slots_changed(teacher, result, base, new_mask)
+                if changed:
+                    history_rows.append(history.observation_row(teacher_id, checked_at, result.count, base, new_mask))
+                # ✅ 変化があった講師はすぐにまた見に行き、変化がなければ間隔を延ばす
+                interval = poll_policy.next_interval(teacher.poll_interval_seconds, changed)
+                # 枠の公開が予測される時間帯は細かくチェックする
+                next_poll_at = publish_predictor.schedule(
+                    checked_at, poll_policy.next_poll_at(checked_at, interval),
+                    teacher.publish_minute, teacher.publish_half_width,
+                )
+                schedule_updates.append({
+                    "b_teacher_id": teacher_id,
+                    "b_next_poll_at": next_poll_at,
+                    "b_interval": interval,
+                    "b_fail_count": 0,
+                })
+                count_updates.append({
+                    "b_teacher_id": teacher_id,
+                    "b_count": result.count,
+                    "b_checked_at": checked_at,
+                    "b_slot_base": base,
+                    "b_slot_mask": slots.to_bytes(new_mask),
+                })
+
+            # ✅ DBへの書き込みはサイクルの最後にまとめて行う
+            save_poll_results(count_updates, jobs, history_rows, schedule_updates, invalid_ids, recovered_ids)
+            if pending_invalid_ids:
+                drop_pending_teachers(pending_invalid_ids)
                 db.session.commit()
+            write_poller_stats()
 
-
-            if error_count_this_run == len(users):
-                consecutive_errors += 1
-                print(f"⚠ DMMに全ユーザーでアクセス失敗（{consecutive_errors}回連続）")
-                if consecutive_errors >= MAX_ERRORS:
-                    print("🚨 一時的にチェック処理をスキップします")
-                    return
-            else:
-                consecutive_errors = 0
+            if host_errors:
+                breaker = dmm_client.breaker_for(dmm_client.DMM_TOP_URL).stats()
+                print(f"⚠ DMMへのアクセスに {host_errors}/{len(subscribers)} 件失敗しました（ブレーカー: {breaker['state']}）")
+            if invalid_ids:
+                print(f"👻 講師ページが見つからない講師が {len(invalid_ids)} 件ありました（しばらくチェックを休みます）")
 
         except Exception as e:
             print(f"⚠ 通知チェックでエラー発生: {e}")
 
+def update_publish_predictions():
+    # 履歴から講師ごとの公開時刻を学習し直す（1日1回）
+    with app.app_context():
+        since = datetime.utcnow() - timedelta(days=publish_predictor.PREDICT_HISTORY_DAYS)
+        updates = []
+        for teacher_id in db.session.scalars(db.select(Teacher.id).where(Teacher.id.in_(db.select(Subscription.teacher_id)))):
+            events = publish_predictor.publish_events(history.read(db.session, teacher_id, since))
+            prediction = publish_predictor.predict(events)
+            updates.append({
+                "b_teacher_id": teacher_id,
+                "b_minute": prediction.minute if prediction else None,
+                "b_half_width": prediction.half_width if prediction else None,
+            })
+
+        table = Teacher.__table__
+        if updates:
+            db.session.execute(
+                db.update(table)
+                .where(table.c.id == db.bindparam("b_teacher_id"))
+                .values(publish_minute=db.bindparam("b_minute"), publish_half_width=db.bindparam("b_half_width")),
+                updates,
+            )
+        db.session.commit()
+        predicted = sum(1 for update in updates if update["b_minute"] is not None)
+        print(f"🔮 公開時刻を予測しました: {predicted} / {len(updates)} 講師")
+
+# 🌟 古いデータ削除の設定（環境変数 or デフォルト）
+RETENTION_DAYS = int(os.environ.get("RETENTION_DAYS", 30))
+CLEANUP_CHUNK_SIZE = int(os.environ.get("CLEANUP_CHUNK_SIZE", 2000))
+CLEANUP_PAUSE_SECONDS = float(os.environ.get("CLEANUP_PAUSE_SECONDS", 0.05))
+# 空き枠の履歴は月ごとのテーブル単位で、この日数より前に終わった月を削除する
+HISTORY_RETENTION_DAYS = int(os.environ.get("HISTORY_RETENTION_DAYS", 90))
+
+def delete_in_chunks(*deletes):
+    # deletes は「LIMIT 付きの対象選択を含む DELETE」。1チャンクずつコミットし、
+    # 合間に書き込みロックを手放して Web 側の更新を通す。戻り値は DELETE ごとの削除件数
+    deleted = [0] * len(deletes)
+    while True:
+        for i, delete in enumerate(deletes):
+            chunk = db.session.execute(delete).rowcount
+            deleted[i] += chunk
+        db.session.commit()
+        # 最後の DELETE（チャンクを選ぶ本体）が上限未満なら終わり
+        if chunk < CLEANUP_CHUNK_SIZE:
+            return deleted
+        time.sleep(CLEANUP_PAUSE_SECONDS)
+
 def clean_old_data():
     with app.app_context():
-        threshold = datetime.utcnow() - timedelta(days=30)
-        old_users = UserData.query.filter(UserData.last_accessed < threshold).all()
-        for user in old_users:
-            db.session.delete(user)
+        started = time.monotonic()
+        threshold = datetime.utcnow() - timedelta(days=RETENTION_DAYS)
+
+        # 最終アクセスが古いユーザー（last_accessed のインデックスで古い順に取り出す）
+        stale_users = (
+            db.select(Subscriber.user_id)
+            .where(Subscriber.last_accessed < threshold)
+            .order_by(Subscriber.last_accessed, Subscriber.user_id)
+            .limit(CLEANUP_CHUNK_SIZE)
+        )
+        # 同じトランザクション内なので、2つの DELETE は同じユーザーを対象にする
+        deleted_subscriptions, deleted_users = delete_in_chunks(
+            db.delete(Subscription).where(Subscription.user_id.in_(stale_users)),
+            db.delete(Subscriber).where(Subscriber.user_id.in_(stale_users)),
+        )
+
+        # 誰にも登録されていない講師のうち、講師名が分からないもの・存在しないと分かっているものを削除
+        # （講師名が分かっている講師は、次に登録されたときDMMに問い合わせずに済むよう残す）
+        orphan_teachers = (
+            db.select(Teacher.id)
+            .where(
+                ~Teacher.id.in_(db.select(Subscription.teacher_id)),
+                db.or_(Teacher.name.is_(None), Teacher.id.in_(db.select(InvalidTeacher.teacher_id))),
+            )
+            .limit(CLEANUP_CHUNK_SIZE)
+        )
+        [deleted_teachers] = delete_in_chunks(db.delete(Teacher).where(Teacher.id.in_(orphan_teachers)))
+
+        # 送信済み・失敗した通知ジョブも1週間で削除
+        old_jobs = (
+            db.select(NotificationJob.id)
+            .where(
+                NotificationJob.status.in_(["sent", "failed"]),
+                NotificationJob.created_at < datetime.utcnow() - timedelta(days=7),
+            )
+            .limit(CLEANUP_CHUNK_SIZE)
+        )
+        [deleted_jobs] = delete_in_chunks(db.delete(NotificationJob).where(NotificationJob.id.in_(old_jobs)))
+
+        # 期限切れの「存在しない講師番号」の記録
+        db.session.execute(db.delete(InvalidTeacher).where(InvalidTeacher.expires_at < datetime.utcnow()))
+
+        dropped_history = history.drop_expired(db.session, HISTORY_RETENTION_DAYS)
         db.session.commit()
-        print(f"🧹 古いデータを削除しました: {len(old_users)} 件")
+
+        elapsed = time.monotonic() - started
+        print(
+            f"🧹 古いデータを削除しました: ユーザー {deleted_users} 件（登録 {deleted_subscriptions} 件）/ 講師 {deleted_teachers} 件"
+            f" / 通知ジョブ {deleted_jobs} 件 / 履歴 {len(dropped_history)} か月分（{elapsed:.1f}秒）"
+        )
 
 scheduler = BackgroundScheduler()
 #scheduler.add_job(check_teacher_availability, 'interval', minutes=1)
-# 🌟 環境変数から読み込んだ値を使ってチェック間隔を指定！
-interval_minutes = int(os.environ.get("CHECK_INTERVAL_MINUTES", 1))  # ← 環境変数 or デフォルト1分
-scheduler.add_job(check_teacher_availability, 'interval', minutes=interval_minutes)
+# 🌟 講師ごとの間隔は poll_policy で決める（CHECK_INTERVAL_MINUTES は最短の間隔として使う）
+scheduler.add_job(check_teacher_availability, 'interval', seconds=POLL_TICK_SECONDS, max_instances=1, coalesce=True)
+
+scheduler.add_job(deliver_notifications, 'interval', seconds=OUTBOX_INTERVAL_SECONDS)
 
 scheduler.add_job(clean_old_data, 'cron', hour=4)
-scheduler.start()
+
+scheduler.add_job(update_publish_predictions, 'cron', hour=5)
+
+# ✅ gunicorn のワーカーが複数いても、スケジューラーを動かすのはロックを取れた1プロセスだけ
+#    （他のワーカーは待機して、リーダーが落ちたら引き継ぐ）
+SCHEDULER_LOCK_FILE = os.environ.get("SCHEDULER_LOCK_FILE", os.path.join(app.instance_path, "scheduler.lock"))
+SCHEDULER_STANDBY_SECONDS = int(os.environ.get("SCHEDULER_STANDBY_SECONDS", 30))
+
+def start_scheduler():
+    scheduler.start()
+    print(f"⏰ スケジューラーを起動しました (pid={os.getpid()})")
+
+scheduler_lock = None
+
+def start_background_jobs():
+    global scheduler_lock
+    if scheduler_lock is not None:
+        return
+    os.makedirs(os.path.dirname(SCHEDULER_LOCK_FILE), exist_ok=True)
+    scheduler_lock = leader.run_when_leader(SCHEDULER_LOCK_FILE, start_scheduler, retry_seconds=SCHEDULER_STANDBY_SECONDS)
+
+# 🌟 RUN_SCHEDULER=1 のときだけ、Webプロセスでもポーリングする（Render の設定は render.yaml）
+#    `flask --app app poller` で別プロセスにできるのは、Webと同じデータベースを参照できるときだけ
+if os.environ.get("RUN_SCHEDULER", "0") == "1":
+    start_background_jobs()
+
+@app.cli.command("poller")
+def run_poller():
+    """講師の空き枠チェックと通知送信を行うポーラーを起動する"""
+    start_background_jobs()
+    try:
+        while True:
+            time.sleep(60)
+    except (KeyboardInterrupt, SystemExit):
+        if scheduler.running:
+            scheduler.shutdown()
+
+@app.cli.command("history")
+@click.argument("teacher_id")
+@click.option("--days", default=7, help="何日前からの履歴を表示するか")
+def show_history(teacher_id, days):
+    """講師の空き枠の変化履歴を表示する"""
+    since = datetime.utcnow() - timedelta(days=days)
+    for observation in history.read(db.session, teacher_id, since):
+        observed_at = observation.observed_at + slots.JST_OFFSET
+        print(f"{observed_at:%Y-%m-%d %H:%M:%S}  {observation.count:3d}枠")
 
 
 from flask import send_file  # ← すでにあるかも。なければこれを追加！
@@ -297,10 +1077,20 @@ from flask import send_file  # ← すでにあるかも。なければこれを
 @app.route("/download")
 def download_db():
     try:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        db_path = os.path.join(base_dir, "database.db")
-        print(f"📁 DBファイルのパス: {db_path}")
-        return send_file(db_path, as_attachment=True)
+        # WAL にある最近の書き込みも含めるため、ファイルをそのまま送らず sqlite3 のバックアップAPIで複製する
+        print(f"📁 DBファイルのパス: {db.engine.url.database}")
+        with tempfile.TemporaryDirectory() as tmp:
+            backup_path = os.path.join(tmp, "database.db")
+            source = db.engine.raw_connection()
+            try:
+                with sqlite3.connect(backup_path) as target:
+                    source.driver_connection.backup(target)
+                target.close()
+            finally:
+                source.close()
+            with open(backup_path, "rb") as f:
+                data = io.BytesIO(f.read())
+        return send_file(data, as_attachment=True, download_name="database.db")
     except Exception as e:
         print(f"❌ ダウンロード失敗: {e}")
         return f"ダウンロードに失敗しました: {e}"
@@ -310,5 +1100,7 @@ def download_db():
 
 
 if __name__ == "__main__":
+    # 手元で python app.py するときは1プロセスでポーラーも動かす
+    start_background_jobs()
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port, debug=False, use_reloader=False)
@@ -0,0 +1,105 @@
+# 講師ページの解析（ページ全体の BeautifulSoup / 高速抽出）の処理時間と
+# tracemalloc のピークメモリ・確保ブロック数を比べるベンチマーク
+#
+#   python benchmarks/bench_parse.py saved_pages/*.html
+#
+# 保存した講師ページを指定しなければ、それらしいダミーページを作って計測する。
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import teacher_page  # noqa: E402
+
+
+def dummy_page(days=7, seed=0):
+    rng = random.Random(seed)
+    start = datetime(2025, 4, 1)
+    filler = "".join(f'<div class="profile-item"><p>自己紹介テキスト {i}</p><span>{i}</span></div>' for i in range(1500))
+    schedule = []
+    for day in range(days):
+        schedule.append('<ul class="oneday">')
+        schedule.append(f'<li class="date">{(start + timedelta(days=day)):%m月%d日}</li>')
+        for slot in range(48):
+            launched = start + timedelta(days=day, minutes=30 * slot)
+            if rng.random() < 0.2:
+                schedule.append(f'<li><a href="#" class="bt-open" id="a:3:{{s:8:&quot;launched&quot;;s:19:&quot;{launched:%Y-%m-%d %H:%M:%S}&quot;}}">予約可</a></li>')
+            else:
+                schedule.append('<li class="no">終了</li>')
+        schedule.append("</ul>")
+    return (
+        '<!DOCTYPE html><html lang="ja"><head><meta charset="UTF-8"><title>講師</title></head><body>'
+        f'<h1>Teacher {seed}</h1>{filler}<div class="schedules-list">{"".join(schedule)}</div>{filler}</body></html>'
+    ).encode("utf-8")
+
+
+def measure(func, pages, repeat):
+    times = []
+    peaks = []
+    blocks = []
+    results = []
+    for content in pages:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            results.append(func(content))
+            times.append(time.perf_counter() - started)
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        kept = func(content)
+        after = tracemalloc.take_snapshot()
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        # 結果を保持したまま比較して、1ページで残ったブロック数を数える
+        blocks.append(sum(stat.count_diff for stat in after.compare_to(before, "filename")))
+        del kept
+    return results, times, peaks, blocks
+
+
+def report(name, times, peaks, blocks):
+    print(f"{name:12s} 平均 {statistics.mean(times) * 1000:8.3f}ms  中央値 {statistics.median(times) * 1000:8.3f}ms"
+          f"  ピークメモリ {max(peaks) / 1024:9.1f}KiB  確保ブロック {statistics.mean(blocks):9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pages", nargs="*", help="保存した講師ページのHTMLファイル")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--parser", default=teacher_page.HTML_PARSER, help="html.parser / lxml")
+    args = parser.parse_args()
+
+    if args.pages:
+        pages = [open(path, "rb").read() for path in args.pages]
+    else:
+        pages = [dummy_page(seed=i) for i in range(5)]
+    print(f"{len(pages)}ページ（平均 {statistics.mean(len(p) for p in pages) / 1024:.0f}KiB）")
+
+    full_soup = lambda content: teacher_page.make_soup(content, parser=args.parser)  # noqa: E731
+    print(f"パーサー: {args.parser}")
+
+    soup_results, *soup_stats = measure(teacher_page.count_available_soup, pages, args.repeat)
+    fast_results, *fast_stats = measure(teacher_page.count_available_fast, pages, args.repeat)
+    # 実際の取得処理と同じ「講師名 + 空き枠」の読み取り
+    page_results, *page_stats = measure(
+        lambda content: (teacher_page.teacher_name(content, args.parser), teacher_page.extract_slots(content)),
+        pages, args.repeat)
+
+    report("soup", *soup_stats)
+    report("fast", *fast_stats)
+    report("name+slots", *page_stats)
+    # DOMそのものの大きさ（パース結果を保持したときのブロック数）
+    report("soup(DOM)", *measure(full_soup, pages, 1)[1:])
+
+    mismatches = sum(1 for a, b in zip(soup_results, fast_results) if a != b)
+    print(f"fast と soup の結果の不一致: {mismatches}件")
+    names = {name for name, _ in page_results}
+    print(f"講師名: {sorted(names)[:3]}")
+
+
+if __name__ == "__main__":
+    main()
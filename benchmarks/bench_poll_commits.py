@@ -0,0 +1,113 @@
+# ポーリング1サイクル分の書き込みを「1行ごとにコミット」と「まとめて1回」で比べるベンチマーク
+#
+#   python benchmarks/bench_poll_commits.py --rows 2000 --teachers 400
+#
+# サイクル中に別スレッドで index() 相当の処理（last_accessed の UPDATE + SELECT）を
+# 繰り返し、そのレイテンシも合わせて表示する（コミット数はWeb側の分も含む）。
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import (Column, DateTime, Integer, MetaData, String, Table, bindparam,
+                        create_engine, event, select, update)
+
+metadata = MetaData()
+user_data = Table(
+    "user_data", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("teacher_id", String(100), nullable=False),
+    Column("last_available_count", Integer, default=0),
+    Column("user_id", String(255), nullable=False),
+    Column("last_accessed", DateTime),
+)
+
+
+def setup(path, rows, teachers):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False, "timeout": 30})
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(user_data.insert(), [
+            {"teacher_id": str(i % teachers), "user_id": f"user_{i % (rows // 3 + 1)}",
+             "last_available_count": 0, "last_accessed": datetime.utcnow()}
+            for i in range(rows)
+        ])
+    return engine
+
+
+def cycle_per_row(engine, counts):
+    # 変更前: 1行ごとに UPDATE + COMMIT
+    with engine.connect() as conn:
+        rows = conn.execute(select(user_data.c.id, user_data.c.teacher_id)).all()
+        for row_id, teacher_id in rows:
+            conn.execute(update(user_data).where(user_data.c.id == row_id)
+                         .values(last_available_count=counts[teacher_id]))
+            conn.commit()
+
+
+def cycle_batched(engine, counts):
+    # 変更後: 講師単位の executemany を1トランザクションで
+    stmt = (update(user_data).where(user_data.c.teacher_id == bindparam("b_teacher_id"))
+            .values(last_available_count=bindparam("b_count")))
+    with engine.begin() as conn:
+        conn.execute(stmt, [{"b_teacher_id": t, "b_count": c} for t, c in counts.items()])
+
+
+def web_load(engine, stop, latencies):
+    while not stop.is_set():
+        user_id = f"user_{random.randint(0, 100)}"
+        started = time.perf_counter()
+        with engine.connect() as conn:
+            conn.execute(update(user_data).where(user_data.c.user_id == user_id)
+                         .values(last_accessed=datetime.utcnow()))
+            conn.commit()
+            conn.execute(select(user_data).where(user_data.c.user_id == user_id)).all()
+        latencies.append(time.perf_counter() - started)
+        time.sleep(0.005)
+
+
+def run(name, cycle, rows, teachers):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = setup(os.path.join(tmp, "bench.db"), rows, teachers)
+        commits = []
+        event.listen(engine, "commit", lambda conn: commits.append(1))
+        counts = {str(t): random.randint(0, 20) for t in range(teachers)}
+
+        stop = threading.Event()
+        latencies = []
+        web = threading.Thread(target=web_load, args=(engine, stop, latencies))
+        web.start()
+        time.sleep(0.1)
+        commits.clear()
+
+        started = time.perf_counter()
+        cycle(engine, counts)
+        elapsed = time.perf_counter() - started
+        cycle_commits = len(commits)
+
+        stop.set()
+        web.join()
+        engine.dispose()
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else 0.0
+    print(f"{name:10s} サイクル {elapsed * 1000:8.1f}ms  コミット数 {cycle_commits:6d}  "
+          f"web p50 {statistics.median(latencies) * 1000:6.1f}ms  p99 {p99 * 1000:6.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--teachers", type=int, default=400)
+    args = parser.parse_args()
+
+    run("per-row", cycle_per_row, args.rows, args.teachers)
+    run("batched", cycle_batched, args.rows, args.teachers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# ポーリング中の「/」のレイテンシを、SQLite の設定ごとに比べるベンチマーク
+#
+#   python benchmarks/bench_sqlite_tuning.py --users 300 --teachers 500 --seconds 10
+#
+# 設定ごとに子プロセスで app を読み込み、ポーラーの書き込み（講師ページの取得は
+# ダミー）を回しながら、複数スレッドで「/」にアクセスして p50 / p99 を表示する。
+import argparse
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROFILES = {
+    # 変更前と同じ SQLite のデフォルト
+    "default": {"SQLITE_JOURNAL_MODE": "DELETE", "SQLITE_SYNCHRONOUS": "FULL",
+                "SQLITE_MMAP_SIZE": "0", "SQLITE_CACHE_SIZE_KB": "2000"},
+    # app.py のデフォルト
+    "tuned": {},
+}
+
+
+def child(args):
+    sys.path.insert(0, ROOT)
+    import app as flask_app
+
+    with flask_app.app.app_context():
+        db = flask_app.db
+        db.session.execute(db.insert(flask_app.Teacher), [
+            {"id": str(t), "name": f"teacher {t}", "last_available_count": 0} for t in range(args.teachers)
+        ])
+        db.session.execute(db.insert(flask_app.Subscriber), [
+            {"user_id": f"user_{u}", "pushbullet_token": "token"} for u in range(args.users)
+        ])
+        db.session.execute(db.insert(flask_app.Subscription), [
+            {"user_id": f"user_{u}", "teacher_id": str(t)}
+            for u in range(args.users) for t in random.sample(range(args.teachers), 3)
+        ])
+        db.session.commit()
+
+    # 講師ページの取得はダミー（DBの書き込み負荷だけを再現する）
+    def fake_page(teacher_id):
+        time.sleep(0.001)
+        slots = flask_app.teacher_page.Slots(count=random.randint(0, 20), times=set())
+        return flask_app.teacher_page.FetchedPage(name=f"Teacher {teacher_id}", slots=slots, fetched_at=datetime.utcnow())
+    flask_app.get_teacher_page = fake_page
+    flask_app.notifier.push_link = lambda *a, **kw: {}
+
+    stop = threading.Event()
+
+    def poller():
+        while not stop.is_set():
+            flask_app.check_teacher_availability()
+            flask_app.deliver_notifications()
+
+    latencies = []
+    errors = []
+
+    def web():
+        client = flask_app.app.test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"] = f"user_{random.randrange(args.users)}"
+        while not stop.is_set():
+            started = time.perf_counter()
+            response = client.get("/")
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+    threads = [threading.Thread(target=poller)] + [threading.Thread(target=web) for _ in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    p99 = latencies[max(0, int(len(latencies) * 0.99) - 1)]
+    print(f"{args.profile:8s} requests {len(latencies):6d}  errors {len(errors):4d}  "
+          f"p50 {statistics.median(latencies) * 1000:7.1f}ms  p99 {p99 * 1000:7.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--teachers", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--profile", choices=PROFILES)
+    args = parser.parse_args()
+
+    if args.profile:
+        child(args)
+        return
+
+    for name, profile in PROFILES.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, **profile)
+            env["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+            env["FETCH_RATE_PER_SECOND"] = "0"
+            env["RUN_SCHEDULER"] = "0"
+            # 毎サイクル全講師を取得する（講師ごとの間隔と取得予算は使わない）
+            env["POLL_MIN_SECONDS"] = env["POLL_MAX_SECONDS"] = "0"
+            env["POLL_BUDGET_PER_MINUTE"] = "0"
+            subprocess.run([sys.executable, __file__, "--profile", name,
+                            "--users", str(args.users), "--teachers", str(args.teachers),
+                            "--threads", str(args.threads), "--seconds", str(args.seconds)],
+                           env=env, check=True, stdout=None)
+
+
+if __name__ == "__main__":
+    main()
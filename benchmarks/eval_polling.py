@@ -0,0 +1,160 @@
+# 記録した空き枠の履歴を再生して、チェック方法ごとの「検出までの遅れ」と「リクエスト数」を比べる
+#
+#   python benchmarks/eval_polling.py --db database.db --days 28 --train-days 14
+#   python benchmarks/eval_polling.py --teachers 200            # ダミーの履歴で比べる
+#
+# 前半（--train-days）の履歴で公開時刻を学習し、後半の期間を各方法でチェックしたことにして
+#   fixed-N     : N秒ごとに全講師をチェック
+#   adaptive    : poll_policy の間隔（変化がなければ倍々に延ばす）
+#   predictive  : adaptive + publish_predictor の時間帯だけ細かくチェック
+# を比べる。履歴の時刻そのものも当時のチェック間隔で検出した時刻なので、遅れはそこからの差になる。
+import argparse
+import bisect
+import os
+import random
+import statistics
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import history  # noqa: E402
+import poll_policy  # noqa: E402
+import publish_predictor  # noqa: E402
+
+
+def load_history(path, since, until):
+    from sqlalchemy import create_engine, text
+
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.connect() as conn:
+        teacher_ids = set()
+        for table in history.partitions(conn):
+            teacher_ids.update(row.teacher_id for row in conn.execute(text(f"SELECT DISTINCT teacher_id FROM {table}")))
+        return {teacher_id: history.read(conn, teacher_id, since, until) for teacher_id in sorted(teacher_ids)}
+
+
+def dummy_history(teachers, since, until, seed=0):
+    # 毎日ほぼ決まった時刻に枠をまとめて公開し、ときどきキャンセル（1枠）と予約（枠が減る）がある講師
+    rng = random.Random(seed)
+    observations = {}
+    for t in range(teachers):
+        regular = rng.random() < 0.7
+        publish_minute = rng.randrange(publish_predictor.MINUTES_PER_DAY)
+        changes = []
+        day = since.replace(hour=0, minute=0, second=0, microsecond=0)
+        while day < until:
+            if regular and rng.random() < 0.9:
+                changes.append((day + timedelta(minutes=publish_minute + rng.gauss(0, 5)), rng.randint(10, 30)))
+            elif not regular and rng.random() < 0.5:
+                changes.append((day + timedelta(minutes=rng.randrange(publish_predictor.MINUTES_PER_DAY)), rng.randint(10, 30)))
+            for _ in range(rng.randint(0, 3)):
+                changes.append((day + timedelta(minutes=rng.randrange(publish_predictor.MINUTES_PER_DAY)), 1))
+            for _ in range(rng.randint(0, 6)):
+                changes.append((day + timedelta(minutes=rng.randrange(publish_predictor.MINUTES_PER_DAY)), -1))
+            day += timedelta(days=1)
+
+        count = 20
+        teacher_observations = [history.Observation(since, count, None, None)]
+        for when, delta in sorted(changes):
+            if since < when < until:
+                count = max(0, count + delta)
+                teacher_observations.append(history.Observation(when.replace(microsecond=0), count, None, None))
+        observations[str(t)] = teacher_observations
+    return observations
+
+
+def simulate(changes, start, end, next_time):
+    # changes の時刻の直後のチェックで検出したとして、(リクエスト数, 変化ごとの遅れ秒) を返す
+    polls = 0
+    latencies = [None] * len(changes)
+    now = start
+    last = start
+    state = {}
+    while now < end:
+        polls += 1
+        first = bisect.bisect_right(changes, last)
+        seen = bisect.bisect_right(changes, now)
+        for i in range(first, seen):
+            latencies[i] = (now - changes[i]).total_seconds()
+        last = now
+        now = next_time(now, seen > first, state)
+    return polls, latencies
+
+
+def fixed_policy(seconds):
+    return lambda now, changed, state: now + timedelta(seconds=seconds)
+
+
+def adaptive_policy(prediction=None):
+    def next_time(now, changed, state):
+        state["interval"] = poll_policy.next_interval(state.get("interval"), changed)
+        default_next = now + timedelta(seconds=state["interval"])
+        if prediction is None:
+            return default_next
+        return publish_predictor.schedule(now, default_next, prediction.minute, prediction.half_width)
+    return next_time
+
+
+def percentile(values, q):
+    values = sorted(values) or [0]
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", help="履歴を記録した SQLite ファイル（指定しなければダミーの履歴）")
+    parser.add_argument("--teachers", type=int, default=100, help="ダミーの講師数")
+    parser.add_argument("--days", type=int, default=28)
+    parser.add_argument("--train-days", type=int, default=14)
+    parser.add_argument("--fixed", default="60,300,900", help="比べる固定間隔（秒、カンマ区切り）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    until = datetime.utcnow().replace(microsecond=0)
+    since = until - timedelta(days=args.days)
+    split = since + timedelta(days=args.train_days)
+    if args.db:
+        observations = load_history(args.db, since, until)
+    else:
+        observations = dummy_history(args.teachers, since, until, args.seed)
+
+    policies = {f"fixed-{seconds}": lambda p, s=int(seconds): fixed_policy(s) for seconds in args.fixed.split(",")}
+    policies["adaptive"] = lambda p: adaptive_policy()
+    policies["predictive"] = lambda p: adaptive_policy(p)
+
+    rng = random.Random(args.seed)
+    results = {name: {"polls": 0, "publish": [], "changes": []} for name in policies}
+    predicted = 0
+    for teacher_observations in observations.values():
+        train = [o for o in teacher_observations if o.observed_at < split]
+        test = [o for o in teacher_observations if o.observed_at >= split]
+        prediction = publish_predictor.predict(publish_predictor.publish_events(train))
+        predicted += prediction is not None
+
+        changes = [o.observed_at for o in test]
+        publishes = set(publish_predictor.publish_events(train[-1:] + test))
+        # 講師ごとにチェックの開始位置をずらす（全員が同じ時刻にチェックするわけではないため）
+        start = split + timedelta(seconds=rng.uniform(0, 60))
+        for name, make_policy in policies.items():
+            polls, latencies = simulate(changes, start, until, make_policy(prediction))
+            results[name]["polls"] += polls
+            for change, latency in zip(changes, latencies):
+                if latency is None:
+                    continue
+                results[name]["changes"].append(latency)
+                if change in publishes:
+                    results[name]["publish"].append(latency)
+
+    test_days = (until - split).total_seconds() / 86400
+    print(f"講師 {len(observations)} 人（公開時刻を予測できた講師 {predicted} 人）/ 評価期間 {test_days:.1f} 日")
+    print(f"{'方法':12s} {'リクエスト/講師/日':>18s} {'公開の遅れ 平均':>14s} {'p50':>8s} {'p90':>8s} {'全変化の遅れ p50':>16s}")
+    for name, result in results.items():
+        publish = result["publish"] or [0]
+        per_day = result["polls"] / max(1, len(observations)) / test_days
+        print(f"{name:12s} {per_day:18.1f} {statistics.mean(publish):13.0f}秒 {percentile(publish, 0.5):7.0f}秒"
+              f" {percentile(publish, 0.9):7.0f}秒 {percentile(result['changes'], 0.5):15.0f}秒")
+
+
+if __name__ == "__main__":
+    main()
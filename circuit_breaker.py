@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # 直近 window_size 回の結果のうち失敗の割合が failure_rate 以上になったら開き（リクエストを止める）、
+    # open_seconds 後に半開きにして probes 本だけ試す。成功すれば閉じ、失敗すれば開く時間を倍にする
+    def __init__(self, window_size=20, min_calls=5, failure_rate=0.5, open_seconds=30, max_open_seconds=600, probes=1):
+        self.window_size = window_size
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.base_open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.probes = probes
+
+        self.state = CLOSED
+        self._results = deque(maxlen=window_size)
+        self._open_seconds = open_seconds
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._lock = threading.Lock()
+
+        # 📊 状態の確認用
+        self.opened_count = 0
+        self.rejected = 0
+
+    def _open(self, now):
+        self.state = OPEN
+        self._opened_at = now
+        self._probes_in_flight = 0
+        self.opened_count += 1
+
+    def retry_after(self):
+        # 開いているとき、半開きになるまでの秒数（閉じていれば0）
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self._open_seconds - time.monotonic())
+
+    def allow(self):
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() < self._opened_at + self._open_seconds:
+                    self.rejected += 1
+                    return False
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self._probes_in_flight >= self.probes:
+                    self.rejected += 1
+                    return False
+                self._probes_in_flight += 1
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.state = CLOSED
+                self._results.clear()
+                self._open_seconds = self.base_open_seconds
+                self._probes_in_flight = 0
+                return
+            self._results.append(True)
+
+    def record_failure(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.state == HALF_OPEN:
+                self._open_seconds = min(self.max_open_seconds, self._open_seconds * 2)
+                self._open(now)
+                return
+            if self.state == OPEN:
+                return
+            self._results.append(False)
+            failures = self._results.count(False)
+            if len(self._results) >= self.min_calls and failures / len(self._results) >= self.failure_rate:
+                self._results.clear()
+                self._open(now)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "recent_calls": len(self._results),
+                "recent_failures": self._results.count(False),
+                "open_seconds": self._open_seconds,
+                "opened_count": self.opened_count,
+                "rejected": self.rejected,
+            }
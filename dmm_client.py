@@ -0,0 +1,101 @@
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from circuit_breaker import CircuitBreaker
+from fetcher import FETCH_MAX_WORKERS, fetch_engine
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+}
+
+DMM_TOP_URL = "https://eikaiwa.dmm.com/"
+
+# 🌟 DMMへのコネクションを何本まで使い回すか（取得ワーカー + 登録処理の分）
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", FETCH_MAX_WORKERS + 2))
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT_SECONDS", 5))
+
+# 🌟 サーキットブレーカーの設定（直近の失敗率が高くなったらしばらくリクエストを止める）
+# 通信層では再試行しないので、get 1回 = リクエスト1回 = 結果1件として数える
+BREAKER_WINDOW = int(os.environ.get("DMM_BREAKER_WINDOW", 20))
+BREAKER_MIN_CALLS = int(os.environ.get("DMM_BREAKER_MIN_CALLS", 5))
+BREAKER_FAILURE_RATE = float(os.environ.get("DMM_BREAKER_FAILURE_RATE", 0.5))
+BREAKER_OPEN_SECONDS = int(os.environ.get("DMM_BREAKER_OPEN_SECONDS", 30))
+BREAKER_MAX_OPEN_SECONDS = int(os.environ.get("DMM_BREAKER_MAX_OPEN_SECONDS", 600))
+BREAKER_PROBES = int(os.environ.get("DMM_BREAKER_PROBES", 1))
+
+# 講師ページが無い（退会した講師など）ことを表す get_teacher_page の戻り値
+NOT_FOUND = "not_found"
+
+
+class HostUnavailableError(requests.exceptions.RequestException):
+    # サーキットブレーカーが開いていて、リクエストを送らなかった
+    pass
+
+
+def create_session(pool_size=HTTP_POOL_SIZE):
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    session.headers["Connection"] = "keep-alive"
+
+    # 通信層では再試行しない（再試行が取得レートの制限やブレーカーを素通りしてしまうため）。
+    # 失敗した講師はポーラーが少し後に取り直し、障害が続けばブレーカーが止める
+    # 接続先はほぼ eikaiwa.dmm.com だけなので、ホスト単位のプールは1つで十分
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# ✅ 全スクレイピング処理で共有するセッション（TLS接続を使い回す）
+session = create_session()
+
+
+def teacher_url(teacher_id):
+    return f"https://eikaiwa.dmm.com/teacher/index/{teacher_id}/"
+
+
+# ✅ 接続先のホストごとのサーキットブレーカー
+breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(url):
+    host = urlsplit(url).netloc
+    with _breakers_lock:
+        if host not in breakers:
+            breakers[host] = CircuitBreaker(
+                window_size=BREAKER_WINDOW,
+                min_calls=BREAKER_MIN_CALLS,
+                failure_rate=BREAKER_FAILURE_RATE,
+                open_seconds=BREAKER_OPEN_SECONDS,
+                max_open_seconds=BREAKER_MAX_OPEN_SECONDS,
+                probes=BREAKER_PROBES,
+            )
+        return breakers[host]
+
+
+def is_host_failure(response):
+    # サーバー側の障害か混雑（講師ページが無い 404 などはホストの失敗に数えない）
+    return response.status_code >= 500 or response.status_code == 429
+
+
+def get(url, timeout=HTTP_TIMEOUT, **kwargs):
+    # DMMへのリクエストは必ずブレーカーとレート制限を通してから共有セッションで送る
+    breaker = breaker_for(url)
+    if not breaker.allow():
+        raise HostUnavailableError(f"{urlsplit(url).netloc} へのリクエストを一時停止中です")
+    fetch_engine.throttle()
+    try:
+        response = session.get(url, timeout=timeout, **kwargs)
+    except requests.exceptions.RequestException:
+        breaker.record_failure()
+        raise
+    if is_host_failure(response):
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
@@ -0,0 +1,60 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rate_limiter import TokenBucket
+
+# 🌟 同時に投げるリクエスト数の上限（環境変数 or デフォルト4）
+FETCH_MAX_WORKERS = int(os.environ.get("FETCH_MAX_WORKERS", 4))
+# 🌟 DMM全体へのリクエスト数の上限（1秒あたり）
+FETCH_RATE_PER_SECOND = float(os.environ.get("FETCH_RATE_PER_SECOND", 1.0))
+# 🌟 間が空いたときに連続で投げてよいリクエスト数
+FETCH_RATE_BURST = int(os.environ.get("FETCH_RATE_BURST", 3))
+
+
+class FetchEngine:
+    def __init__(self, max_workers=FETCH_MAX_WORKERS, rate_per_second=FETCH_RATE_PER_SECOND, burst=FETCH_RATE_BURST):
+        self.max_workers = max_workers
+        self.limiter = TokenBucket(rate_per_second, burst)
+        self.last_stats = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dmm-fetch")
+
+    def throttle(self):
+        # ✅ DMMへのリクエストは必ずここでトークンを取ってから投げる（全ワーカー共通）
+        return self.limiter.acquire()
+
+    def submit(self, func, *args):
+        # 1件だけバックグラウンドで実行する（同じワーカーを使うので同時接続数の上限は変わらない）
+        return self._executor.submit(func, *args)
+
+    def map(self, func, keys):
+        # keys をワーカーに分配して並列に func(key) を実行し、{key: 結果} を返す
+        keys = list(keys)
+        started = time.monotonic()
+        before = self.limiter.stats()
+        futures = {key: self._executor.submit(func, key) for key in keys}
+
+        results = {}
+        for key, future in futures.items():
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                print(f"⚠ 取得中にエラー発生 ({key}): {e}")
+                results[key] = None
+
+        elapsed = time.monotonic() - started
+        after = self.limiter.stats()
+        self.last_stats = {
+            "requests": len(keys),
+            "seconds": elapsed,
+            "per_second": len(keys) / elapsed if elapsed > 0 else 0.0,
+            "wait_seconds": after["total_wait_seconds"] - before["total_wait_seconds"],
+        }
+        print(
+            f"📊 {len(keys)}件取得 / {elapsed:.1f}秒（{self.last_stats['per_second']:.2f}件/秒）"
+            f" レート制限の待ち合計 {self.last_stats['wait_seconds']:.1f}秒"
+        )
+        return results
+
+
+fetch_engine = FetchEngine()
@@ -0,0 +1,124 @@
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text
+
+import slots
+
+# 空き枠の観測履歴（追記のみ）。月ごとに availability_history_YYYYMM テーブルへ分けて保存し、
+# 古い月はテーブルごと DROP する。各行は前回から空き枠が変わったときだけ書く（変化点の記録）
+TABLE_PREFIX = "availability_history_"
+
+# observed_at は UTC の UNIX 秒、slot_base は日付の通し番号（date.toordinal）、
+# slot_mask は slots.to_bytes の可変長バイト列（1週間分でも 42 バイト）
+# 主キー順に並ぶ WITHOUT ROWID テーブルなので、講師ごとの期間読み出しは連続した範囲を読むだけで済む
+_CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        teacher_id TEXT NOT NULL,
+        observed_at INTEGER NOT NULL,
+        slot_count INTEGER NOT NULL,
+        slot_base INTEGER,
+        slot_mask BLOB,
+        PRIMARY KEY (teacher_id, observed_at)
+    ) WITHOUT ROWID
+"""
+
+Observation = namedtuple("Observation", ["observed_at", "count", "slot_base", "mask"])
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def table_name(when):
+    return f"{TABLE_PREFIX}{when:%Y%m}"
+
+
+def to_epoch(when):
+    return int((when - _EPOCH).total_seconds())
+
+
+def from_epoch(seconds):
+    return _EPOCH + timedelta(seconds=seconds)
+
+
+def _months(since, until):
+    month = date(since.year, since.month, 1)
+    while month <= until.date():
+        yield month
+        month = (month + timedelta(days=32)).replace(day=1)
+
+
+def partitions(session):
+    rows = session.execute(
+        text("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE :prefix ORDER BY name"),
+        {"prefix": TABLE_PREFIX + "%"},
+    )
+    return [row.name for row in rows]
+
+
+def _ensure_table(session, table):
+    # 呼び出し側のトランザクションがロールバックされるとテーブルも消えるので、作ったことは覚えずに毎回確かめる
+    # （IF NOT EXISTS なので、あれば何もしない。1サイクルに月の数だけ）
+    session.execute(text(_CREATE_TABLE.format(table=table)))
+
+
+def observation_row(teacher_id, observed_at, count, base=None, mask=None):
+    return {
+        "teacher_id": teacher_id,
+        "observed_at": to_epoch(observed_at),
+        "slot_count": count,
+        "slot_base": base.toordinal() if base is not None else None,
+        "slot_mask": slots.to_bytes(mask) if mask is not None else None,
+    }
+
+
+def record(session, rows):
+    # 1サイクル分の行を月ごとにまとめて executemany で書く（コミットは呼び出し側）
+    by_table = {}
+    for row in rows:
+        by_table.setdefault(table_name(from_epoch(row["observed_at"])), []).append(row)
+    for table, table_rows in by_table.items():
+        _ensure_table(session, table)
+        session.execute(
+            text(f"INSERT OR REPLACE INTO {table} (teacher_id, observed_at, slot_count, slot_base, slot_mask)"
+                 " VALUES (:teacher_id, :observed_at, :slot_count, :slot_base, :slot_mask)"),
+            table_rows,
+        )
+    return len(rows)
+
+
+def read(session, teacher_id, since, until=None):
+    # since〜until（UTC）の講師の観測を古い順に返す
+    until = until or datetime.utcnow()
+    existing = set(partitions(session))
+    observations = []
+    for month in _months(since, until):
+        table = table_name(month)
+        if table not in existing:
+            continue
+        rows = session.execute(
+            text(f"SELECT observed_at, slot_count, slot_base, slot_mask FROM {table}"
+                 " WHERE teacher_id = :teacher_id AND observed_at BETWEEN :since AND :until ORDER BY observed_at"),
+            {"teacher_id": teacher_id, "since": to_epoch(since), "until": to_epoch(until)},
+        )
+        observations.extend(
+            Observation(
+                observed_at=from_epoch(row.observed_at),
+                count=row.slot_count,
+                slot_base=datetime.fromordinal(row.slot_base) if row.slot_base is not None else None,
+                mask=slots.from_bytes(row.slot_mask) if row.slot_mask is not None else None,
+            )
+            for row in rows
+        )
+    return observations
+
+
+def drop_expired(session, retention_days, now=None):
+    # 保持期間より前に終わった月のテーブルを丸ごと消す（行ごとの DELETE や VACUUM が要らない）
+    threshold = (now or datetime.utcnow()) - timedelta(days=retention_days)
+    keep_from = table_name(threshold)
+    dropped = []
+    for table in partitions(session):
+        if table < keep_from:
+            session.execute(text(f"DROP TABLE {table}"))
+            dropped.append(table)
+    return dropped
@@ -0,0 +1,58 @@
+import fcntl
+import os
+import threading
+
+
+class LeaderLock:
+    # 同じマシン上のプロセスのうち、ロックファイルを掴めた1つだけをリーダーにする
+    # （プロセスが落ちるとOSがロックを解放するので、待機中の別プロセスが引き継げる）
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    @property
+    def is_leader(self):
+        return self._file is not None
+
+    def try_acquire(self):
+        if self._file is not None:
+            return True
+        lock_file = open(self.path, "a+")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        self._file = lock_file
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+
+def run_when_leader(path, on_elected, retry_seconds=30):
+    # リーダーになれたら on_elected() を呼ぶ。なれなければ待機スレッドで定期的に再挑戦する
+    lock = LeaderLock(path)
+    if lock.try_acquire():
+        on_elected()
+        return lock
+
+    def standby():
+        stopped = threading.Event()
+        while not stopped.wait(retry_seconds):
+            if lock.try_acquire():
+                print(f"👑 リーダーを引き継ぎました (pid={os.getpid()})")
+                on_elected()
+                return
+
+    threading.Thread(target=standby, name="leader-standby", daemon=True).start()
+    return lock
@@ -0,0 +1,39 @@
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+from pushbullet import InvalidKeyError, PushbulletError, PushError
+
+PUSH_URL = "https://api.pushbullet.com/v2/pushes"
+
+PUSH_POOL_SIZE = int(os.environ.get("PUSH_POOL_SIZE", 4))
+PUSH_TIMEOUT = float(os.environ.get("PUSH_TIMEOUT_SECONDS", 10))
+
+
+def create_session(pool_size=PUSH_POOL_SIZE):
+    session = requests.Session()
+    session.headers["Content-Type"] = "application/json"
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    return session
+
+
+# ✅ Pushbullet API へのコネクションは全通知で使い回す
+session = create_session()
+
+
+def push_link(token, title, url, body=None):
+    # Pushbullet(token) はユーザー情報・端末・チャット・チャンネルを毎回取得してしまうので、
+    # 通知に必要な pushes エンドポイントだけを直接呼び出す
+    data = {"type": "link", "title": title, "url": url}
+    if body:
+        data["body"] = body
+
+    response = session.post(PUSH_URL, json=data, headers={"Access-Token": token}, timeout=PUSH_TIMEOUT)
+    if response.status_code in (401, 403):
+        raise InvalidKeyError()
+    if response.status_code == 429:
+        raise PushbulletError("Too Many Requests, you have been ratelimited")
+    if response.status_code != requests.codes.ok:
+        raise PushError(response.text)
+    return response.json()
@@ -0,0 +1,75 @@
+import threading
+import time
+from concurrent.futures import Future
+
+
+class PageCache:
+    # 取得したページの解析結果を ttl_seconds だけ覚えておくキャッシュ。
+    # 同じキーを同時に取りに来た呼び出しは、最初の1つの取得が終わるのを待って同じ結果を使う（single-flight）
+    def __init__(self, ttl_seconds, max_entries=1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+        # 📊 ヒット率の確認用
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key, loader, cacheable=lambda value: value is not None):
+        # キャッシュになければ loader(key) で取得する（cacheable が False の結果は覚えない）
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                owner = False
+            else:
+                future = self._inflight[key] = Future()
+                self.misses += 1
+                owner = True
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = loader(key)
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            if self.ttl_seconds > 0 and cacheable(value):
+                self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+                self._evict()
+            del self._inflight[key]
+        future.set_result(value)
+        return value
+
+    def _evict(self):
+        if len(self._entries) <= self.max_entries:
+            return
+        now = time.monotonic()
+        for key in [key for key, (expires_at, _) in self._entries.items() if expires_at <= now]:
+            del self._entries[key]
+        # それでも多ければ古く入れたものから捨てる
+        while len(self._entries) > self.max_entries:
+            del self._entries[next(iter(self._entries))]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            }
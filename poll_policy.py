@@ -0,0 +1,39 @@
+import math
+import os
+import random
+from datetime import timedelta
+
+# 🌟 講師ごとのチェック間隔（秒）。変化があれば最短に戻し、変化がなければ倍々に延ばす
+POLL_MIN_SECONDS = int(os.environ.get("POLL_MIN_SECONDS", int(os.environ.get("CHECK_INTERVAL_MINUTES", 1)) * 60))
+POLL_MAX_SECONDS = int(os.environ.get("POLL_MAX_SECONDS", 30 * 60))
+POLL_BACKOFF = float(os.environ.get("POLL_BACKOFF", 2.0))
+# 同じ時刻に固まらないように、次回時刻を間隔の最大この割合だけ後ろにずらす
+POLL_JITTER = float(os.environ.get("POLL_JITTER", 0.1))
+# 1分あたりに取得してよい講師ページの上限（0なら上限なし）
+POLL_BUDGET_PER_MINUTE = int(os.environ.get("POLL_BUDGET_PER_MINUTE", 60))
+
+
+def next_interval(current, changed):
+    if changed or not current:
+        return POLL_MIN_SECONDS
+    return min(POLL_MAX_SECONDS, max(POLL_MIN_SECONDS, int(current * POLL_BACKOFF)))
+
+
+def next_poll_at(now, interval):
+    return now + timedelta(seconds=interval * (1 + random.uniform(0, POLL_JITTER)))
+
+
+def tick_budget(tick_seconds):
+    # 1回のチェックで取得してよい講師の数（None なら上限なし）
+    if POLL_BUDGET_PER_MINUTE <= 0:
+        return None
+    return max(1, math.floor(POLL_BUDGET_PER_MINUTE * tick_seconds / 60))
+
+
+# 🌟 講師ページが見つからなかった講師は、失敗するたびに間隔を倍にして様子を見る（他の講師には影響させない）
+TEACHER_PARK_SECONDS = int(os.environ.get("TEACHER_PARK_SECONDS", 60 * 60))
+TEACHER_PARK_MAX_SECONDS = int(os.environ.get("TEACHER_PARK_MAX_SECONDS", 24 * 60 * 60))
+
+
+def park_seconds(fail_count):
+    return min(TEACHER_PARK_MAX_SECONDS, TEACHER_PARK_SECONDS * 2 ** max(0, fail_count - 1))
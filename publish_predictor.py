@@ -0,0 +1,87 @@
+import math
+import os
+from collections import namedtuple
+from datetime import timedelta
+
+import slots
+
+# 🌟 講師が1週間分の枠をまとめて公開する時刻を履歴から学習し、その前後だけ細かくチェックする
+# 一度にこの数以上の枠が空いたら「公開」とみなす（1枠だけのキャンセル待ちとは分ける）
+PUBLISH_MIN_SLOTS = int(os.environ.get("PUBLISH_MIN_SLOTS", 3))
+# 学習に使う履歴の日数と、予測を出すのに必要な公開の回数
+PREDICT_HISTORY_DAYS = int(os.environ.get("PREDICT_HISTORY_DAYS", 28))
+PREDICT_MIN_EVENTS = int(os.environ.get("PREDICT_MIN_EVENTS", 3))
+# 公開時刻のばらつき（分）がこれより大きい講師は予測しない（いつもの間隔でチェックする）
+PREDICT_MAX_SPREAD_MINUTES = int(os.environ.get("PREDICT_MAX_SPREAD_MINUTES", 45))
+# 予測時刻の前後に足す余裕（分）と、その時間帯のチェック間隔（秒）
+PREDICT_MARGIN_MINUTES = int(os.environ.get("PREDICT_MARGIN_MINUTES", 10))
+POLL_DENSE_SECONDS = int(os.environ.get("POLL_DENSE_SECONDS", 30))
+
+MINUTES_PER_DAY = 24 * 60
+
+# minute は公開時刻（日本時間の0:00からの分）、half_width は細かくチェックする時間帯の片側の幅（分）
+Prediction = namedtuple("Prediction", ["minute", "half_width", "events"])
+
+
+def opened_count(previous, observation):
+    # 2つの観測の間に新しく空いた枠の数（枠が分からなければ枠数の増分）
+    if previous.mask is not None and observation.mask is not None and previous.slot_base is not None:
+        opened = slots.opened_slots(previous.mask, previous.slot_base, observation.mask, observation.slot_base)
+        return bin(opened).count("1")
+    return observation.count - previous.count
+
+
+def publish_events(observations):
+    # history.read の観測（古い順）から、まとめて枠が公開された時刻（UTC）を取り出す
+    return [
+        observation.observed_at
+        for previous, observation in zip(observations, observations[1:])
+        if opened_count(previous, observation) >= PUBLISH_MIN_SLOTS
+    ]
+
+
+def minute_of_day(when):
+    jst = when + slots.JST_OFFSET
+    return jst.hour * 60 + jst.minute
+
+
+def predict(events):
+    # 公開時刻を1日周期の角度にして平均とばらつき（円周標準偏差）を求める
+    if len(events) < PREDICT_MIN_EVENTS:
+        return None
+    angles = [2 * math.pi * minute_of_day(event) / MINUTES_PER_DAY for event in events]
+    c = sum(math.cos(a) for a in angles) / len(angles)
+    s = sum(math.sin(a) for a in angles) / len(angles)
+    r = math.hypot(c, s)
+    if r <= 0:
+        return None
+    spread = math.sqrt(-2 * math.log(min(r, 1.0))) * MINUTES_PER_DAY / (2 * math.pi)
+    if spread > PREDICT_MAX_SPREAD_MINUTES:
+        return None
+    minute = round(math.atan2(s, c) * MINUTES_PER_DAY / (2 * math.pi)) % MINUTES_PER_DAY
+    return Prediction(minute=minute, half_width=math.ceil(2 * spread) + PREDICT_MARGIN_MINUTES, events=len(events))
+
+
+def _distance(a, b):
+    d = abs(a - b) % MINUTES_PER_DAY
+    return min(d, MINUTES_PER_DAY - d)
+
+
+def in_window(now, minute, half_width):
+    return _distance(minute_of_day(now), minute) <= half_width
+
+
+def next_window_start(now, minute, half_width):
+    # now（UTC）より後で、次に予測の時間帯が始まる時刻
+    start_minute = (minute - half_width) % MINUTES_PER_DAY
+    wait = (start_minute - minute_of_day(now)) % MINUTES_PER_DAY or MINUTES_PER_DAY
+    return now.replace(second=0, microsecond=0) + timedelta(minutes=wait)
+
+
+def schedule(now, default_next, minute, half_width):
+    # いつもの次回時刻 default_next を、公開が予測される時間帯だけ前倒しする
+    if minute is None:
+        return default_next
+    if in_window(now, minute, half_width):
+        return min(default_next, now + timedelta(seconds=POLL_DENSE_SECONDS))
+    return min(default_next, next_window_start(now, minute, half_width))
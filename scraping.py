@@ -1,17 +1,18 @@
-import requests
 from bs4 import BeautifulSoup
 from pushbullet import Pushbullet
 import schedule
 import time
 
+import dmm_client
+
 # 最初に講師IDとAPIキーを入力
 teacher_id = input("講師IDを入力: ")
 api_key = input("Pushbullet APIキーを入力: ")
 
 # スクレイピング関数
 def get_teacher_name(teacher_id):
-    url = f"https://eikaiwa.dmm.com/teacher/index/{teacher_id}/"
-    response = requests.get(url)
+    url = dmm_client.teacher_url(teacher_id)
+    response = dmm_client.get(url)
     soup = BeautifulSoup(response.text, "html.parser")
     teacher_name = soup.find("h1")
 
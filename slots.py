@@ -0,0 +1,147 @@
+from datetime import datetime, timedelta
+
+# レッスン枠は30分刻み。base（日本時間のある日の0:00）からの枠番号をビット位置にしたビットマスクで持つ
+SLOT_MINUTES = 30
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+JST_OFFSET = timedelta(hours=9)
+WEEKDAYS = "月火水木金土日"
+
+
+def jst_now():
+    return datetime.utcnow() + JST_OFFSET
+
+
+def slot_base(now=None):
+    # ビット0 に対応する時刻（日本時間の今日の0:00）
+    now = now or jst_now()
+    return datetime(now.year, now.month, now.day)
+
+
+def slot_index(slot_time, base):
+    return int((slot_time - base).total_seconds() // (SLOT_MINUTES * 60))
+
+
+def slot_time(index, base):
+    return base + timedelta(minutes=SLOT_MINUTES * index)
+
+
+def to_mask(slot_times, base):
+    mask = 0
+    for t in slot_times:
+        index = slot_index(t, base)
+        if index >= 0:
+            mask |= 1 << index
+    return mask
+
+
+def to_times(mask, base):
+    times = []
+    index = 0
+    while mask:
+        if mask & 1:
+            times.append(slot_time(index, base))
+        mask >>= 1
+        index += 1
+    return times
+
+
+def align(mask, old_base, new_base):
+    # old_base 基準のマスクを new_base 基準に並べ直す（過ぎた日の分は捨てる）
+    shift = slot_index(new_base, old_base)
+    return mask >> shift if shift >= 0 else mask << -shift
+
+
+def opened_slots(old_mask, old_base, new_mask, new_base):
+    # 前回は空いていなかったのに今回空いている枠（new_base 基準）
+    return new_mask & ~align(old_mask, old_base, new_base)
+
+
+def to_bytes(mask):
+    return mask.to_bytes((mask.bit_length() + 7) // 8, "little")
+
+
+def from_bytes(data):
+    return int.from_bytes(data, "little") if data else 0
+
+
+def format_times(times, limit=10):
+    labels = [f"{t:%m/%d}({WEEKDAYS[t.weekday()]}) {t:%H:%M}" for t in times[:limit]]
+    if len(times) > limit:
+        labels.append(f"ほか{len(times) - limit}枠")
+    return "、".join(labels)
+
+
+# ---- 通知する時間帯（1週間分の30分枠ごとのビットマスク。ビット = 曜日(月=0) * 48 + その日の枠番号） ----
+WEEK_SLOTS = 7 * SLOTS_PER_DAY
+_WEEK_FULL = (1 << WEEK_SLOTS) - 1
+
+
+def window_mask(days, start_hour, end_hour):
+    # 選んだ曜日の start_hour:00 〜 end_hour:00（日本時間）
+    mask = 0
+    for day in days:
+        for index in range(start_hour * 60 // SLOT_MINUTES, end_hour * 60 // SLOT_MINUTES):
+            mask |= 1 << (day * SLOTS_PER_DAY + index)
+    return mask
+
+
+def describe_window(mask):
+    if mask is None:
+        return "いつでも"
+    days = [day for day in range(7) if (mask >> (day * SLOTS_PER_DAY)) & ((1 << SLOTS_PER_DAY) - 1)]
+    if not days:
+        return "なし"
+    day_bits = (mask >> (days[0] * SLOTS_PER_DAY)) & ((1 << SLOTS_PER_DAY) - 1)
+    start = (day_bits & -day_bits).bit_length() - 1
+    end = day_bits.bit_length()
+    label = "".join(WEEKDAYS[day] for day in days)
+    hours = f"{start * SLOT_MINUTES // 60:02d}:{start * SLOT_MINUTES % 60:02d}-{end * SLOT_MINUTES // 60:02d}:{end * SLOT_MINUTES % 60:02d}"
+    return f"{label} {hours}"
+
+
+def window_in_grid(mask, base, length):
+    # 週単位のマスクを base から length 枠分の並びに展開する
+    offset = base.weekday() * SLOTS_PER_DAY
+    rotated = ((mask >> offset) | (mask << (WEEK_SLOTS - offset))) & _WEEK_FULL
+    grid = 0
+    for start in range(0, length, WEEK_SLOTS):
+        grid |= rotated << start
+    return grid & ((1 << length) - 1)
+
+
+class SlotMatchIndex:
+    # 講師ごとの「週の枠 → その枠を通知してほしい登録者の集合（ビットセット）」の逆引き。
+    # 新しく空いた枠のビットを OR するだけで対象者が決まるので、登録者数 × 枠数の判定が要らない
+    def __init__(self, entries):
+        # entries: [(key, 週のマスク or None)]（None は時間帯の指定なし）
+        self.keys = []
+        self.always = 0
+        self.by_slot = {}
+        for i, (key, mask) in enumerate(entries):
+            self.keys.append(key)
+            if mask is None:
+                self.always |= 1 << i
+                continue
+            while mask:
+                low = mask & -mask
+                slot = low.bit_length() - 1
+                self.by_slot[slot] = self.by_slot.get(slot, 0) | (1 << i)
+                mask ^= low
+
+    def match(self, opened, base):
+        # opened（base 基準のマスク）の枠を通知してほしい登録者の key を返す
+        if not opened:
+            return []
+        offset = base.weekday() * SLOTS_PER_DAY
+        matched = self.always
+        while opened:
+            low = opened & -opened
+            matched |= self.by_slot.get((offset + low.bit_length() - 1) % WEEK_SLOTS, 0)
+            opened ^= low
+
+        keys = []
+        while matched:
+            low = matched & -matched
+            keys.append(self.keys[low.bit_length() - 1])
+            matched ^= low
+        return keys
@@ -0,0 +1,103 @@
+import os
+import random
+import re
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+from bs4 import BeautifulSoup
+
+try:
+    import lxml  # noqa: F401
+    _DEFAULT_PARSER = "lxml"
+except ImportError:
+    _DEFAULT_PARSER = "html.parser"
+
+AVAILABLE_MARK = "予約可"
+# 「予約可」だけのテキストノード（BeautifulSoup の find_all(string="予約可") と同じ条件）
+_AVAILABLE_BYTES = f">{AVAILABLE_MARK}<".encode("utf-8")
+# 予約スケジュール部分の開始位置の目印（見つからなければページ全体を対象にする）
+SCHEDULE_MARKERS = (b'class="oneday"', b'class="schedules-list"')
+
+# 🌟 DOMを作るときのパーサー（lxml が入っていれば lxml、なければ html.parser）
+HTML_PARSER = os.environ.get("HTML_PARSER", _DEFAULT_PARSER)
+
+# count は「予約可」の数、times はそのうち日時が読み取れた枠（日本時間）
+Slots = namedtuple("Slots", ["count", "times"])
+# 1回の取得で読み取った講師名と空き枠（fetched_at は取得した時刻）
+FetchedPage = namedtuple("FetchedPage", ["name", "slots", "fetched_at"])
+
+# 講師名の h1 の開始タグ
+_H1_START = re.compile(rb"<h1[\s>]")
+
+# 「予約可」ボタンのタグ属性に入っている枠の日時（例: 2025-04-01 19:30:00）
+_SLOT_TIME = re.compile(rb"(\d{4})-(\d{2})-(\d{2}) (\d{2}):(\d{2})")
+
+# 🌟 高速抽出の結果を BeautifulSoup でも確かめるページの割合（0なら確認しない）
+PARSER_VERIFY_RATE = float(os.environ.get("PARSER_VERIFY_RATE", 0.01))
+
+verify_stats = {"checked": 0, "mismatched": 0}
+_stats_lock = threading.Lock()
+
+
+def schedule_start(content):
+    positions = [pos for pos in (content.find(marker) for marker in SCHEDULE_MARKERS) if pos >= 0]
+    return min(positions) if positions else 0
+
+
+def count_available_fast(content):
+    # DOMを作らず、スケジュール部分のバイト列から「予約可」の数を数える
+    return content.count(_AVAILABLE_BYTES, schedule_start(content))
+
+
+def make_soup(content, parser=None):
+    return BeautifulSoup(content, parser or HTML_PARSER)
+
+
+def teacher_name(content, parser=None):
+    # 最初の h1 だけを切り出して解析する（ページ全体は木にしない）
+    match = _H1_START.search(content)
+    if not match:
+        return None
+    end = content.find(b"</h1>", match.end())
+    name_tag = make_soup(content[match.start():end + len(b"</h1>") if end >= 0 else None], parser).find("h1")
+    return name_tag.text.strip() if name_tag else None
+
+
+def count_available_soup(content):
+    # 高速抽出の確認用。取りこぼしがないようページ全体を木にして数える
+    soup = make_soup(content, parser="html.parser")
+    return len(soup.find_all(string=AVAILABLE_MARK))
+
+
+def count_available(content, teacher_id=None):
+    count = count_available_fast(content)
+
+    if PARSER_VERIFY_RATE > 0 and random.random() < PARSER_VERIFY_RATE:
+        expected = count_available_soup(content)
+        with _stats_lock:
+            verify_stats["checked"] += 1
+            if expected != count:
+                verify_stats["mismatched"] += 1
+        if expected != count:
+            print(f"🚨 空き枠数の抽出結果が一致しません（講師番号: {teacher_id} 高速: {count} / BeautifulSoup: {expected}）")
+            return expected
+    return count
+
+
+def available_slot_times(content):
+    # 「予約可」の直前のタグから枠の日時を読み取る
+    start = schedule_start(content)
+    times = set()
+    pos = content.find(_AVAILABLE_BYTES, start)
+    while pos >= 0:
+        tag_start = content.rfind(b"<", start, pos)
+        match = _SLOT_TIME.search(content, tag_start, pos) if tag_start >= 0 else None
+        if match:
+            times.add(datetime(*map(int, match.groups())))
+        pos = content.find(_AVAILABLE_BYTES, pos + 1)
+    return times
+
+
+def extract_slots(content, teacher_id=None):
+    return Slots(count=count_available(content, teacher_id), times=available_slot_times(content))
@@ -0,0 +1,103 @@
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import pytest
+
+# app は import 時にデータベースを作るので、先に一時ファイルを向けておく
+_tmp = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp, 'test.db')}"
+os.environ["RUN_SCHEDULER"] = "0"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as flask_app  # noqa: E402
+
+db = flask_app.db
+
+
+@pytest.fixture(autouse=True)
+def clean_db():
+    with flask_app.app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add(flask_app.Subscriber(user_id="user_a", pushbullet_token="token"))
+        # 登録済みの講師 100〜108 と、まだ誰も登録していない講師 200
+        for teacher_id in [str(100 + i) for i in range(9)] + ["200"]:
+            db.session.add(flask_app.Teacher(id=teacher_id, name=f"Teacher {teacher_id}", last_available_count=0))
+        db.session.commit()
+    yield
+
+
+def subscribe(count):
+    with flask_app.app.app_context():
+        for i in range(count):
+            db.session.add(flask_app.Subscription(user_id="user_a", teacher_id=str(100 + i)))
+        db.session.commit()
+
+
+@pytest.fixture
+def client():
+    client = flask_app.app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"] = "user_a"
+    return client
+
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with flask_app.app.app_context():
+        engine = db.engine
+    db.event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        db.event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def run_counted(client, registrations, method, **kwargs):
+    subscribe(registrations)
+    with count_queries() as statements:
+        response = getattr(client, method)("/", **kwargs)
+    return response, len(statements)
+
+
+@pytest.mark.parametrize("registrations", [1, 9])
+def test_get_index_runs_one_query(client, registrations):
+    response, count = run_counted(client, registrations, "get")
+    assert response.status_code == 200
+    assert b"Teacher 100" in response.data
+    assert count == 1
+
+
+def test_post_query_count_does_not_grow_with_registrations(client):
+    counts = []
+    for registrations in [1, 9]:
+        with flask_app.app.app_context():
+            db.session.execute(db.delete(flask_app.Subscription))
+            db.session.commit()
+        response, count = run_counted(client, registrations, "post", data={"teacher_id": "200", "pushbullet_token": "token"})
+        assert response.status_code == 302
+        with flask_app.app.app_context():
+            assert flask_app.Subscription.query.filter_by(user_id="user_a", teacher_id="200").count() == 1
+        counts.append(count)
+    assert counts[0] == counts[1]
+
+
+@pytest.mark.parametrize("registrations", [1, 9])
+def test_post_duplicate_teacher_runs_one_query(client, registrations):
+    response, count = run_counted(client, registrations, "post", data={"teacher_id": "100", "pushbullet_token": "token"})
+    assert response.status_code == 302
+    # 重複は登録一覧の1回のクエリから判定する
+    assert count == 1
+
+
+def test_post_without_teacher_id_is_rejected(client):
+    response = client.post("/", data={"pushbullet_token": "token"}, follow_redirects=True)
+    assert response.status_code == 200
+    assert "すべての項目を入力してください" in response.get_data(as_text=True)
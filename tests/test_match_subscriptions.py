@@ -0,0 +1,98 @@
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+import pytest
+
+# app は import 時にデータベースを作るので、先に一時ファイルを向けておく
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}")
+os.environ["RUN_SCHEDULER"] = "0"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as flask_app  # noqa: E402
+import slots  # noqa: E402
+
+db = flask_app.db
+MONDAY = datetime(2026, 10, 19)
+
+
+@pytest.fixture(autouse=True)
+def clean_db(monkeypatch):
+    monkeypatch.setattr(flask_app, "match_indexes", {})
+    with flask_app.app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add(flask_app.Teacher(id="100", name="Teacher A", last_available_count=0))
+        db.session.add(flask_app.Subscriber(user_id="user_a", pushbullet_token="old-token"))
+        db.session.add(flask_app.Subscriber(user_id="user_b", pushbullet_token="token-b"))
+        db.session.add(flask_app.Subscription(user_id="user_a", teacher_id="100"))
+        morning = slots.to_bytes(slots.window_mask([0], 9, 12))
+        db.session.add(flask_app.Subscription(user_id="user_b", teacher_id="100", window_mask=morning))
+        db.session.commit()
+    yield
+
+
+def subscription_rows(teacher_id):
+    # ポーラーと同じ形の行を読む
+    with flask_app.app.app_context():
+        return (
+            db.session.query(flask_app.Subscription.id, flask_app.Subscription.teacher_id,
+                             flask_app.Subscription.window_mask, flask_app.Subscriber.pushbullet_token)
+            .join(flask_app.Subscriber, flask_app.Subscriber.user_id == flask_app.Subscription.user_id)
+            .filter(flask_app.Subscription.teacher_id == teacher_id)
+            .order_by(flask_app.Subscription.id)
+            .all()
+        )
+
+
+def opened_at(*hours):
+    return slots.to_mask([MONDAY.replace(hour=hour) for hour in hours], MONDAY)
+
+
+def matched_tokens(rows, opened):
+    return sorted(sub.pushbullet_token for sub, _ in flask_app.match_subscriptions("100", rows, opened, MONDAY))
+
+
+def test_window_limits_matches():
+    rows = subscription_rows("100")
+    assert matched_tokens(rows, opened_at(10)) == ["old-token", "token-b"]
+    assert matched_tokens(rows, opened_at(15)) == ["old-token"]
+
+    # 時間帯の外の枠は、その人向けの時刻からも外す
+    times = dict((sub.pushbullet_token, t) for sub, t in flask_app.match_subscriptions("100", rows, opened_at(10, 15), MONDAY))
+    assert times["token-b"] == [MONDAY.replace(hour=10)]
+    assert times["old-token"] == [MONDAY.replace(hour=10), MONDAY.replace(hour=15)]
+
+
+def test_cached_index_uses_current_token():
+    assert matched_tokens(subscription_rows("100"), opened_at(15)) == ["old-token"]
+    cached = flask_app.match_indexes["100"]
+
+    with flask_app.app.app_context():
+        db.session.execute(db.update(flask_app.Subscriber).where(flask_app.Subscriber.user_id == "user_a").values(pushbullet_token="new-token"))
+        db.session.commit()
+
+    assert matched_tokens(subscription_rows("100"), opened_at(15)) == ["new-token"]
+    # 登録内容は変わっていないので、逆引きは作り直さない
+    assert flask_app.match_indexes["100"] is cached
+
+
+def test_index_rebuilt_when_subscriptions_change():
+    matched_tokens(subscription_rows("100"), opened_at(15))
+    cached = flask_app.match_indexes["100"]
+
+    with flask_app.app.app_context():
+        db.session.execute(db.update(flask_app.Subscription).where(flask_app.Subscription.user_id == "user_b").values(window_mask=None))
+        db.session.commit()
+
+    assert matched_tokens(subscription_rows("100"), opened_at(15)) == ["old-token", "token-b"]
+    assert flask_app.match_indexes["100"] is not cached
+
+
+def test_cache_keeps_most_recently_used_teachers(monkeypatch):
+    monkeypatch.setattr(flask_app, "MATCH_INDEX_MAX_ENTRIES", 2)
+    rows = subscription_rows("100")
+    for teacher_id in ["1", "2", "1", "3"]:
+        flask_app.match_subscriptions(teacher_id, rows, opened_at(10), MONDAY)
+    assert list(flask_app.match_indexes) == ["1", "3"]